@@ -1,6 +1,10 @@
 from decimal import Decimal
+import re
 from music21 import pitch, key, harmony, roman
 
+# Leading Roman numeral of a figure such as "V7" or "ii"
+_ROMAN_NUMERAL_RE = re.compile(r"([ivIV]+)")
+
 
 def analyze_chord_progression(chord_progression, key_str):
     """Analyze a chord progression and return information for melody generation"""
@@ -216,9 +220,7 @@ def determine_function_from_roman(rn):
     except AttributeError:
         # Fallback if scaleDegree is not available
         # Extract scale degree from the figure (e.g., "V" -> 5)
-        import re
-
-        match = re.match(r"([ivIV]+)", rn.figure)
+        match = _ROMAN_NUMERAL_RE.match(rn.figure)
         if match:
             roman_numeral = match.group(1).upper()
             # Convert Roman numeral to integer
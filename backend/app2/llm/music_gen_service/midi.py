@@ -1,10 +1,13 @@
 import json
 import re
-from typing import Dict, List, Any, Optional, Union
+from functools import lru_cache
+from itertools import chain, repeat
+from typing import Dict, Iterable, List, Any, Optional, Tuple, Union
 import os
 import base64
 import logging
 import mido
+import numpy as np
 from mido import Message, MidiFile, MidiTrack
 from music21 import harmony
 from app2.core.config import settings
@@ -17,6 +20,11 @@ from app2.llm.music_gen_service.music_utils import get_root_note_midi
 
 logger = logging.getLogger(__name__)
 
+# Splits a dash-separated chord progression ("Cm-Aaug-Dm") into its non-empty chords
+_CHORD_TOKEN_RE = re.compile(r"[^-]+")
+# Chords in a free-form progression may be separated by dashes, commas or whitespace
+_CHORD_SEPARATOR_RE = re.compile(r"[-,\s]+")
+
 def get_chord_progression_from_key(key: str, chord_progression: str) -> str:
     """
     Get the chord progression for a given key.
@@ -54,28 +62,26 @@ def transform_drum_beats_to_midi_format(drum_pattern: List[bool]) -> Dict[str, A
     if not drum_pattern:
         return result
 
-    notes = []
+    # Silent pattern: nothing to emit
+    if not any(drum_pattern):
+        return {"notes": []}
+
     sixteenth_duration = 0.25  # Duration of a 16th note in beats
 
-    # Process each drum sound
-    for i, hit in enumerate(drum_pattern):
-        # Get pitch from mapping or use a default
-        pitch = settings.audio.DEFAULT_SAMPLER_BASE_NOTE
-
-        # Process the pattern (32 booleans representing 16th notes over 2 bars)
-        if hit:
-            # Calculate start time in beats (each 16th note is 0.25 beats in 4/4 time)
-            start_time = i * sixteenth_duration
-
-            # Create a note event
-            note = {
-                "pitch": pitch,
-                "start": start_time * settings.audio.PPQ,  # Convert to ticks (480 ticks per beat)
-                "duration": sixteenth_duration * settings.audio.PPQ,  # Duration in ticks
-                "velocity": 0.8,  # Default velocity for drums
-            }
+    # Resolve settings once rather than per step
+    pitch = settings.audio.DEFAULT_SAMPLER_BASE_NOTE
+    sixteenth_ticks = sixteenth_duration * settings.audio.PPQ  # Duration in ticks
+
+    # Steps that hit (32 booleans representing 16th notes over 2 bars);
+    # each 16th note is 0.25 beats in 4/4 time
+    hit_steps = [i for i, hit in enumerate(drum_pattern) if hit]
 
-            notes.append(note)
+    notes = _build_midi_notes(
+        repeat(pitch),
+        [i * sixteenth_ticks for i in hit_steps],  # Convert to ticks (480 ticks per beat)
+        repeat(sixteenth_ticks),
+        repeat(0.8),  # Default velocity for drums
+    )
 
     return {"notes": notes}
 
@@ -91,7 +97,7 @@ def correct_notes_in_key(
         logger.info("Correction: Skipping note correction as chord analysis data is not available.")
         return melody_data
 
-    parsed_chords = [c.strip() for c in re.split(r'[-,\s]+', chord_progression_str) if c.strip()]
+    parsed_chords = [c.strip() for c in _CHORD_SEPARATOR_RE.split(chord_progression_str) if c.strip()]
     if not parsed_chords:
         logger.info("Correction: Skipping note correction as no chords found in progression.")
         return melody_data
@@ -107,9 +113,9 @@ def correct_notes_in_key(
         
         # Use our more reliable function to get the complete set of scale pitch classes
         allowed_pitch_classes = get_complete_scale_pitch_classes(normalized_key_for_scale, mode_name)
-        logger.info(f"Correction: Allowed pitch classes for '{normalized_key_for_scale} {mode_name}': {allowed_pitch_classes}")
+        logger.info("Correction: Allowed pitch classes for '%s %s': %s", normalized_key_for_scale, mode_name, allowed_pitch_classes)
     except ValueError as e:
-        logger.info(f"Correction: Cannot get scale pitch classes: {e}. Skipping correction.")
+        logger.info("Correction: Cannot get scale pitch classes: %s. Skipping correction.", e)
         return melody_data
 
     corrected_bars: List[Bar] = []
@@ -122,7 +128,7 @@ def correct_notes_in_key(
             original_pitch_class = original_pitch % 12
 
             if original_pitch_class not in allowed_pitch_classes:
-                logger.info(f"Correction: Note {original_pitch} (class {original_pitch_class}) at beat {note.start_beat} in bar {bar_item.bar} is out of key.")
+                logger.info("Correction: Note %s (class %s) at beat %s in bar %s is out of key.", original_pitch, original_pitch_class, note.start_beat, bar_item.bar)
 
                 current_note_absolute_beat = current_bar_start_beat + note.start_beat
                 chord_segment_index = int(current_note_absolute_beat / beats_per_chord_segment)
@@ -140,9 +146,9 @@ def correct_notes_in_key(
                     if isinstance(note_weights, dict):
                         current_chord_note_weights = note_weights
                     else:
-                        logger.info(f"Warning: note_weights for chord {current_chord_name} is not a dict: {type(note_weights)}. Value: {note_weights}")
+                        logger.info("Warning: note_weights for chord %s is not a dict: %s. Value: %s", current_chord_name, type(note_weights), note_weights)
                 else:
-                    logger.info(f"Warning: current_chord_specific_analysis for chord {current_chord_name} is not a dict: {type(current_chord_specific_analysis)}. Value: {current_chord_specific_analysis}")
+                    logger.info("Warning: current_chord_specific_analysis for chord %s is not a dict: %s. Value: %s", current_chord_name, type(current_chord_specific_analysis), current_chord_specific_analysis)
 
                 possible_corrections = []
 
@@ -262,15 +268,15 @@ def correct_notes_in_key(
                     best_corrected_pitch = closest_candidates[0]["pitch"]
 
                     if best_corrected_pitch != original_pitch:
-                        logger.info(f"Correction: Corrected to {best_corrected_pitch} (class {best_corrected_pitch % 12}). Original: {original_pitch}. Chord: {current_chord_name}. Details: {closest_candidates[0]}")
+                        logger.info("Correction: Corrected to %s (class %s). Original: %s. Chord: %s. Details: %s", best_corrected_pitch, best_corrected_pitch % 12, original_pitch, current_chord_name, closest_candidates[0])
                         new_notes_for_bar.append(note.model_copy(update={'pitch': best_corrected_pitch}))
                     else:
                         # This case means the original note was already the best choice among in-key notes, 
                         # which contradicts it being out-of-key initially. This path should ideally not be taken if a note is truly out of key.
-                        logger.info(f"Correction: Note {original_pitch} deemed best fit or no better in-key correction found. Keeping. (Check logic if note was initially out-of-key)")
+                        logger.info("Correction: Note %s deemed best fit or no better in-key correction found. Keeping. (Check logic if note was initially out-of-key)", original_pitch)
                         new_notes_for_bar.append(note)
                 else:
-                    logger.info(f"Correction: Could not find any in-key correction for {original_pitch} in search window. Keeping original.")
+                    logger.info("Correction: Could not find any in-key correction for %s in search window. Keeping original.", original_pitch)
                     new_notes_for_bar.append(note)
             else:
                 new_notes_for_bar.append(note)
@@ -278,7 +284,7 @@ def correct_notes_in_key(
         if new_notes_for_bar:
                 corrected_bars.append(Bar(bar=bar_item.bar, notes=new_notes_for_bar))
         elif melody_data.bars : # if original bar had notes but corrected has none, still add empty bar to maintain structure if needed, or decide to omit
-            logger.info(f"Correction: Bar {bar_item.bar} became empty after attempting corrections. Original notes: {len(bar_item.notes)}")
+            logger.info("Correction: Bar %s became empty after attempting corrections. Original notes: %d", bar_item.bar, len(bar_item.notes))
             # corrected_bars.append(Bar(bar=bar_item.bar, notes=[])) # Option to keep empty bar
 
     return MelodyData(bars=corrected_bars)
@@ -331,7 +337,7 @@ def convert_interval_melody_to_absolute_melody(interval_melody: "IntervalMelodyO
                     pitch_to_play = current_midi_note # Ensure clamped value is used
 
                 except ValueError:
-                    logger.info(f"Warning: Could not parse interval '{i_note.interval}'. Treating as hold/same note as previous.")
+                    logger.info("Warning: Could not parse interval '%s'. Treating as hold/same note as previous.", i_note.interval)
                     pitch_to_play = current_midi_note 
             
             if not is_rest:
@@ -356,8 +362,6 @@ def convert_interval_melody_to_absolute_melody(interval_melody: "IntervalMelodyO
     return MelodyData(bars=absolute_melody_bars)
 
 def transform_melody_data_to_instrument_format(melody_data: MelodyData, beats_per_bar: int = 4) -> Dict[str, Any]:
-    notes_list = []
-    
     processed_bars = list(melody_data.bars) # Start with a mutable copy
 
     # Calculate total duration of actual notes for the duplication logic
@@ -383,24 +387,82 @@ def transform_melody_data_to_instrument_format(melody_data: MelodyData, beats_pe
     #     else:
     #         logger.info("No bars to duplicate.")
     
+    pitches: List[int] = []
+    velocities: List[int] = []
+    start_beats: List[float] = []
+    duration_beats: List[float] = []
     for bar_item in processed_bars:
         bar_start_offset_beats = (bar_item.bar - 1) * beats_per_bar
         for note in bar_item.notes:
-            absolute_note_start_beat = bar_start_offset_beats + note.start_beat
-            notes_list.append({
-                "pitch": note.pitch,
-                "start": absolute_note_start_beat * settings.audio.PPQ,
-                "duration": note.duration_beats * settings.audio.PPQ,
-                "velocity": note.velocity,
-            })
-            # No longer using a cumulative current_time here, as absolute_note_start_beat provides the correct timing.
+            pitches.append(note.pitch)
+            velocities.append(note.velocity)
+            start_beats.append(bar_start_offset_beats + note.start_beat)
+            duration_beats.append(note.duration_beats)
+            # No longer using a cumulative current_time here, as the bar offset plus start_beat provides the correct timing.
+
+    # Convert all note timings to ticks in one pass
+    ppq = settings.audio.PPQ
+    notes_list = _build_midi_notes(
+        pitches,
+        _beats_to_ticks(start_beats, ppq),
+        _beats_to_ticks(duration_beats, ppq),
+        velocities,
+    )
 
     return {
         "notes": notes_list,
     }
 
+def _beats_to_ticks(beats: List[float], ppq: int) -> List[int]:
+    """
+    Convert a batch of beat values (start times or durations) to integer MIDI ticks.
+
+    Args:
+        beats: Beat values to convert
+        ppq: Ticks per quarter note
+
+    Returns:
+        List of tick values rounded to the nearest integer
+    """
+    return np.rint(np.asarray(beats, dtype=np.float64) * ppq).astype(np.int64).tolist()
+
+
+def _build_midi_notes(
+    pitches: Iterable[int],
+    starts: Iterable[Any],
+    durations: Iterable[Any],
+    velocities: Iterable[Any],
+) -> List[Dict[str, Any]]:
+    """
+    Materialize column-wise note data into the note dicts stored in midi_notes_json.
+
+    Notes are kept as parallel sequences while they are computed; the dict form
+    is only needed at the serialization boundary, so it is built once here.
+    Output length follows the shortest input, so constant columns may be
+    passed as itertools.repeat.
+
+    Args:
+        pitches: MIDI pitch per note
+        starts: Start time in ticks per note
+        durations: Duration in ticks per note
+        velocities: Velocity per note
+
+    Returns:
+        List of note dictionaries with pitch, start, duration and velocity
+    """
+    return [
+        {"pitch": pitch, "start": start, "duration": duration, "velocity": velocity}
+        for pitch, start, duration, velocity in zip(
+            pitches, starts, durations, velocities
+        )
+    ]
+
+
 def transform_bars_to_instrument_format(
-    data: Dict[str, Any], instrument: InstrumentFileRead, key: str
+    data: Dict[str, Any],
+    instrument: InstrumentFileRead,
+    key: str,
+    start_pitch: Optional[int] = None,
 ) -> Dict[str, Any]:
     """
     Transform the structured bars data from Claude into the expected instrument format.
@@ -408,83 +470,72 @@ def transform_bars_to_instrument_format(
     Args:
         data: Dictionary with bars data from Claude
         instrument_id: ID of the instrument
+        start_pitch: MIDI pitch the first interval is measured from (the key's root
+            note if not given)
 
     Returns:
         Formatted data in the expected output structure
     """
 
-    print("INSTRUMENT:", instrument)
     root_note_midi = get_root_note_midi(key)
-    print("ROOT NOTE MIDI:", root_note_midi)
     # Extract bars data
     data.get("starting_octave", 4)
     bars = data.get("bars", [])
 
-    # Prepare MIDI notes array
-    midi_notes = []
+    # Sounding notes are collected column-wise so the tick conversion can be batched
+    pitches: List[int] = []
+    velocities: List[int] = []
+    start_beats: List[float] = []
+    duration_beats: List[float] = []
     current_time = 0.0
-    current_pitch = root_note_midi  # Start at root note
+    # Start at root note, or where an earlier passage of the melody left off
+    current_pitch = root_note_midi if start_pitch is None else start_pitch
 
     # Get the root note from the key and mode
 
-    # Process each bar and its notes
-    for bar in bars:
-        bar_notes = bar.get("notes", [])
-
-        for note in bar_notes:
-            # Parse interval and convert to number
-            interval_str = note.get("interval", "0")
-            if isinstance(interval_str, str):
-                if interval_str.startswith("+"):
-                    interval = int(interval_str[1:])
-                elif interval_str.startswith("-"):
-                    interval = -int(interval_str[1:])
-                elif interval_str.startswith("R"):
-                    interval = 0  # Rest - keep same pitch but may have velocity 0
-                else:
-                    interval = int(interval_str)
-            else:
-                interval = int(interval_str)
-
-            # Get duration and velocity
-            duration_str = note.get("duration")
-            velocity = note.get("velocity", 64)  # Default velocity if not specified
-
-            # Convert duration string to beats
-            try:
-                note_duration = _convert_duration_to_beats(duration_str)
-            except ValueError:
-                logger.warning(
-                    f"Invalid duration: {duration_str}, defaulting to quarter note"
-                )
-                note_duration = 1.0  # Default to quarter note
-
-            # Calculate new pitch based on interval
-            if interval_str.startswith("R"):
-                # For rests, keep the same pitch but set velocity to 0
-                velocity = 0
-            else:
-                current_pitch += interval
-
-            # Create MIDI note
-            midi_note = {
-                "pitch": current_pitch,
-                "start": current_time * 480,
-                "duration": note_duration * 480,
-                "velocity": velocity,
-            }
-
-            # Add to notes array
-            if velocity > 0:
-                midi_notes.append(midi_note)
-
-            # Update current time
+    # Bars carry no per-note state here, so walk their notes as one flat stream
+    for note in chain.from_iterable(bar.get("notes", []) for bar in bars):
+        # Convert duration string to beats
+        duration_str = note.get("duration")
+        try:
+            note_duration = _convert_duration_to_beats(duration_str)
+        except ValueError:
+            logger.warning(
+                "Invalid duration: %s, defaulting to quarter note", duration_str
+            )
+            note_duration = 1.0  # Default to quarter note
+
+        # Intervals arrive as strings from the LLM JSON
+        interval_str = note.get("interval", "0")
+        if interval_str[:1] == "R":
+            # Rest - keep the same pitch and only advance time
             current_time += note_duration
+            continue
 
-    # Create the full result structure
-
-    print("INSTRUMENT:", instrument)
+        # Calculate new pitch based on interval; int() accepts explicit "+"/"-" signs
+        current_pitch += int(interval_str)
+
+        # Add to notes array unless explicitly silenced
+        velocity = note.get("velocity", 64)  # Default velocity if not specified
+        if velocity > 0:
+            pitches.append(current_pitch)
+            velocities.append(velocity)
+            start_beats.append(current_time)
+            duration_beats.append(note_duration)
+
+        # Update current time
+        current_time += note_duration
+
+    # Convert all note timings to ticks in one pass
+    ppq = settings.audio.PPQ
+    midi_notes = _build_midi_notes(
+        pitches,
+        _beats_to_ticks(start_beats, ppq),
+        _beats_to_ticks(duration_beats, ppq),
+        velocities,
+    )
 
+    # Create the full result structure
     # Map from the instrument object to the correct field names
     # Handle both possible formats for compatibility
     result = {
@@ -494,8 +545,6 @@ def transform_bars_to_instrument_format(
         "notes": {"notes": midi_notes},
     }
 
-    print("RESULT:", result)
-
     return result
 
 
@@ -513,11 +562,9 @@ def transform_chord_progression_to_instrument_format(
     Returns:
         Dictionary with formatted instrument data including MIDI notes
     """
-    print("CHORD PROGRESSION:", chord_progression)
-    print("INSTRUMENT:", instrument)
-    print("KEY:", key)
-    chord_progression_list = list(filter(None, chord_progression.split("-")))
-    print("CHORD PROGRESSION LIST:", chord_progression_list)
+    # Non-empty chord tokens in a single pass
+    chord_progression_list = _CHORD_TOKEN_RE.findall(chord_progression)
+    logger.debug("Chord progression list for key %s: %s", key, chord_progression_list)
     if len(chord_progression_list) == 0:
         return []
     if len(chord_progression_list) == 1:
@@ -532,33 +579,34 @@ def transform_chord_progression_to_instrument_format(
 
     # Initialize MIDI notes array
     midi_notes = []
-    current_time = 0.0
 
-    # Default duration for each chord (1 bar = 4 beats in 4/4 time)
+    # Default duration for each chord (1 bar = 4 beats in 4/4 time). Chords are laid
+    # out back to back, so timing is tracked in whole ticks to avoid float drift.
     chord_duration = 4.0
+    duration_ticks = int(round(chord_duration * settings.audio.PPQ))
+    current_ticks = 0
 
     # Process each chord
-    filtered_chord_progression_list = [chord for chord in chord_progression_list if chord]
-    for chord_name in filtered_chord_progression_list:
+    for chord_name in chord_progression_list:
         # Parse the chord name into MIDI notes
         try:
             chord_notes = _parse_chord_name(chord_name.strip(), key, octave=3)
 
-            # Add each note in the chord
-            for pitch in chord_notes:
-                midi_note = {
-                    "pitch": pitch,
-                    "start": current_time * 480,
-                    "duration": chord_duration * 480,
-                    "velocity": 70,  # Default velocity for chords
-                }
-                midi_notes.append(midi_note)
+            # Every note in the chord shares the same timing, only the pitch varies
+            midi_notes.extend(
+                _build_midi_notes(
+                    chord_notes,
+                    repeat(current_ticks),
+                    repeat(duration_ticks),
+                    repeat(70),  # Default velocity for chords
+                )
+            )
 
             # Move to next chord
-            current_time += chord_duration
+            current_ticks += duration_ticks
 
         except ValueError as e:
-            logger.warning(f"Skipping invalid chord {chord_name}: {str(e)}")
+            logger.warning("Skipping invalid chord %s: %s", chord_name, e)
             continue
 
     # Create the full result structure
@@ -586,11 +634,65 @@ def _parse_chord_name(chord_name: str, key: str, octave: int = 4) -> List[int]:
     Returns:
         List of MIDI note values
     """
-    logger.info(f"Parsing chord name: {chord_name}")
+    return list(_chord_pitches(chord_name))
+
+
+@lru_cache(maxsize=256)
+def _chord_pitches(chord_name: str) -> Tuple[int, ...]:
+    """
+    Resolve a chord name to its MIDI pitches with music21, caching the result.
+
+    Building a ChordSymbol is by far the most expensive step of chord parsing and
+    progressions repeat the same handful of chords, so results are shared process-wide.
+
+    Args:
+        chord_name: String of chord name (e.g. "C", "Cm", "Bbmaj7")
+
+    Returns:
+        Tuple of MIDI note values
+    """
+    logger.debug("Parsing chord name: %s", chord_name)
     # Convert 'b' flats to '-' for music21
-    chord_name = chord_name.replace("b", "-")
-    chord = harmony.ChordSymbol(chord_name)
-    return [note.midi for note in chord.pitches]
+    chord = harmony.ChordSymbol(chord_name.replace("b", "-"))
+    return tuple(note.midi for note in chord.pitches)
+
+
+# Standard durations in beats (assuming 4/4 time)
+_BASE_DURATION_MAP: Dict[str, float] = {
+    "whole": 4.0,
+    "half": 2.0,
+    "quarter": 1.0,
+    "eighth": 0.5,
+    "sixteenth": 0.25,
+    "thirtysecond": 0.125,
+    "sixtyfourth": 0.0625,
+    # Allow numerical fractions too
+    "1": 4.0,
+    "2": 2.0,
+    "4": 1.0,
+    "8": 0.5,
+    "16": 0.25,
+    "32": 0.125,
+    "64": 0.0625,
+    # Dotted durations
+    "dotted whole": 6.0,
+    "dotted half": 3.0,
+    "dotted quarter": 1.5,
+    "dotted eighth": 0.75,
+    "dotted sixteenth": 0.375,
+    # Triplets
+    "triplet": 1 / 3,
+    "half triplet": 4 / 3,
+    "quarter triplet": 2 / 3,
+    "eighth triplet": 1 / 3,
+    "sixteenth triplet": 1 / 6,
+}
+
+# Built once at import: base durations plus dotted notes specified with a dot ("quarter.")
+_DURATION_MAP: Dict[str, float] = {
+    **_BASE_DURATION_MAP,
+    **{f"{name}.": beats * 1.5 for name, beats in _BASE_DURATION_MAP.items()},
+}
 
 
 def _convert_duration_to_beats(
@@ -606,49 +708,15 @@ def _convert_duration_to_beats(
     Returns:
         Duration in beats
     """
-    # If duration_str is already a number, return it directly
-    if isinstance(duration_str, (int, float)):
-        return float(duration_str)
-
-    # Standard durations in beats (assuming 4/4 time)
-    duration_map = {
-        "whole": 4.0,
-        "half": 2.0,
-        "quarter": 1.0,
-        "eighth": 0.5,
-        "sixteenth": 0.25,
-        "thirtysecond": 0.125,
-        "sixtyfourth": 0.0625,
-        # Allow numerical fractions too
-        "1": 4.0,
-        "2": 2.0,
-        "4": 1.0,
-        "8": 0.5,
-        "16": 0.25,
-        "32": 0.125,
-        "64": 0.0625,
-        # Dotted durations
-        "dotted whole": 6.0,
-        "dotted half": 3.0,
-        "dotted quarter": 1.5,
-        "dotted eighth": 0.75,
-        "dotted sixteenth": 0.375,
-        # Triplets
-        "triplet": 1 / 3,
-        "half triplet": 4 / 3,
-        "quarter triplet": 2 / 3,
-        "eighth triplet": 1 / 3,
-        "sixteenth triplet": 1 / 6,
-    }
-
-    # Try to get the duration from the map
-    duration = duration_map.get(str(duration_str).lower())
-
-    # Handle dotted notes specified with a dot
-    if not duration and isinstance(duration_str, str) and duration_str.endswith("."):
-        base_dur = duration_map.get(duration_str[:-1].lower())
-        if base_dur:
-            duration = base_dur * 1.5
+    # Try to get the duration from the map (dotted "quarter." forms are precomputed).
+    # Canonical lowercase names hit directly; only fall back to lower() on a miss.
+    # Anything but a string (numbers, or a list/dict from a malformed note) skips the
+    # map, since unhashable values can't be looked up in it.
+    duration = None
+    if isinstance(duration_str, str):
+        duration = _DURATION_MAP.get(duration_str)
+        if duration is None:
+            duration = _DURATION_MAP.get(duration_str.lower())
 
     # If not found, try to parse as a float
     if not duration:
@@ -682,38 +750,29 @@ def get_clean_track_data(tracks_data: Union[List, Dict, Any]) -> List[Dict[str,
         try:
             tracks_data = json.loads(tracks_data)
         except json.JSONDecodeError:
-            logger.error(f"Failed to parse tracks_data as JSON: {tracks_data[:100]}...")
+            logger.error("Failed to parse tracks_data as JSON: %s...", tracks_data[:100])
             return []
 
     # If it's not a list, return empty list
     if not isinstance(tracks_data, list):
-        logger.warning(f"tracks_data is not a list: {type(tracks_data)}")
+        logger.warning("tracks_data is not a list: %s", type(tracks_data))
         return []
 
-    # Filter out None values, "None" strings, and non-dict values
-    cleaned_tracks = []
+    # Filter out None values, "None" strings, and non-dict values.
+    # The output never outgrows the input, so size it up front and trim at the end.
+    cleaned_tracks: List[Optional[Dict[str, Any]]] = [None] * len(tracks_data)
+    count = 0
     for track in tracks_data:
-        # Skip explicit None values
-        if track is None:
-            logger.warning(f"Skipping None track: {track}")
-            continue
-
-        # Skip "None" string values
-        if track == "None" or track == '"None"':
-            logger.warning(f"Skipping None string track: {track}")
-            continue
-
-        # Ensure track is a dictionary
+        # Ensure track is a dictionary (this also skips None and "None" strings)
         if not isinstance(track, dict):
-            logger.warning(f"Skipping non-dict track: {track}")
+            logger.warning("Skipping non-dict track: %s", track)
             continue
 
         # Extract all notes from patterns
-        all_notes = []
-        if "instrument" in track and "patterns" in track["instrument"]:
-            for pattern in track["instrument"]["patterns"]:
-                if "notes" in pattern:
-                    all_notes.extend(pattern["notes"])
+        patterns = track.get("instrument", {}).get("patterns") or []
+        all_notes = list(
+            chain.from_iterable(p["notes"] for p in patterns if "notes" in p)
+        )
 
         # Create cleaned track data in TrackData format
         cleaned_track = {
@@ -723,9 +782,13 @@ def get_clean_track_data(tracks_data: Union[List, Dict, Any]) -> List[Dict[str,
             "storage_key": track.get("storage_key"),
         }
 
-        cleaned_tracks.append(cleaned_track)
+        cleaned_tracks[count] = cleaned_track
+        count += 1
 
+    del cleaned_tracks[count:]
     logger.info(
-        f"Cleaned tracks: {len(cleaned_tracks)} valid tracks from {len(tracks_data)} original items"
+        "Cleaned tracks: %d valid tracks from %d original items",
+        len(cleaned_tracks),
+        len(tracks_data),
     )
     return cleaned_tracks
\ No newline at end of file
@@ -1,11 +1,14 @@
 import asyncio
-from dataclasses import dataclass, field
+from dataclasses import dataclass, field, replace
+from functools import lru_cache
 import json
+import logging
 import os
+import re
+import time
 import traceback
-from typing import Any, Dict, List, Optional
+from typing import Any, Awaitable, Dict, List, Optional, Set, Tuple
 import uuid
-import anthropic
 from dotenv import load_dotenv
 from app2.sse.sse_queue_manager import SSEQueueManager
 from app2.core.logging import get_api_logger
@@ -19,6 +22,7 @@ from app2.models.public_models.instrument_file import InstrumentFileRead
 from app2.models.track_models.sampler_track import SamplerTrackRead
 from app2.models.track_models.drum_track import DrumTrackRead
 from app2.models.public_models.drum_samples import DrumSamplePublicRead
+from app2.services.drum_sample_service import DrumSampleService
 from app2.llm.music_gen_service.chord_progression_analysis import (
     analyze_chord_progression,
 )
@@ -35,30 +39,242 @@ from app2.llm.music_gen_service.music_gen_tools import (
     DETERMINE_MUSICAL_PARAMETERS_TOOL,
     SELECT_DRUM_SOUNDS_TOOL,
     SELECT_INSTRUMENTS_TOOL,
-    CREATE_DRUM_BEAT_TOOL,
+    CREATE_DRUM_PATTERN_TOOL,
+    PARAMETER_TOOLS,
+    WRITE_MELODY_NOTES_TOOL,
 )
 from app2.llm.music_gen_service.prompt_utils import (
     get_ai_composer_agent_initial_system_prompt,
     get_melody_create_prompt,
 )
 from app2.llm.music_gen_service.music_researcher import MusicResearcher
-import re
 from sqlmodel import Session
 from app2.core.config import settings
 
 load_dotenv()
 logger = get_api_logger("music_gen_service")
 
+_JSON_DECODER = json.JSONDecoder()
+
+# Chords in a progression may be separated by dashes, commas or whitespace
+_CHORD_SEPARATOR_RE = re.compile(r"[-,\s]+")
+
+# Parameter and instrument selection are simple classification turns that don't need
+# the main model; melody composition stays on MODEL_ID
+FAST_MODEL_ID = os.getenv("FAST_MODEL_ID", "claude-3-5-haiku-latest")
+
+# Melody bars written per parallel composer request; one chord is played per bar
+MELODY_SEGMENT_BARS = 2
+_BEATS_PER_BAR = 4
+# Requests per melody segment before it is left silent
+_MELODY_SEGMENT_ATTEMPTS = 2
+# Longest melody written for create_melody's duration_bars
+_MAX_MELODY_BARS = 8
+
+# Line and block comments the model sometimes leaves inside JSON
+# (line comments first as the common case; character classes instead of lazy dots)
+_JSON_COMMENT_RE = re.compile(r"//[^\n]*|/\*[\s\S]*?\*/")
+
+# Lets the model write its reasoning before calling a tool in the same turn
+# (a forced tool_choice starts the response directly at the tool_use block)
+_AUTO_TOOL_CHOICE = {"type": "auto"}
+
+
+# Drum patterns are written as step strings like "x...x..." (about a token per few
+# steps) instead of arrays of 32 JSON booleans. The characters match the pattern
+# create_drum_pattern's schema allows.
+_DRUM_HIT_STEPS = frozenset("xX")
+_DRUM_REST_STEPS = frozenset(".-")
+_DRUM_STEP_SEPARATORS = frozenset("| ")
+
+
+def _place_segment_notes(
+    notes: List[Dict[str, Any]], start_bar: int, bars: int
+) -> List[Dict[str, Any]]:
+    """
+    Notes of a melody segment written from tick 0, clipped to its `bars` bars and
+    shifted to start at bar `start_bar`. Notes the model wrote past the segment's end
+    are dropped (and longer ones cut) so they can't overlap the next segment.
+    """
+    ticks_per_bar = _BEATS_PER_BAR * settings.audio.PPQ
+    segment_ticks = bars * ticks_per_bar
+    offset = start_bar * ticks_per_bar
+    placed = []
+    for note in notes:
+        start = note["start"]
+        if start >= segment_ticks:
+            continue
+        note["duration"] = min(note["duration"], segment_ticks - start)
+        note["start"] = start + offset
+        placed.append(note)
+    if len(placed) < len(notes):
+        logger.warning(
+            "Dropped %s melody notes written past bar %s.",
+            len(notes) - len(placed),
+            start_bar + bars,
+        )
+    return placed
+
+
+def _parse_positive_int(value: Any) -> Optional[int]:
+    """
+    A positive whole number from tool input, where it may arrive as an int, a whole
+    float or a numeric string; None for anything else. bool is an int subclass, so it
+    is ruled out explicitly.
+    """
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    elif isinstance(value, str) and value.strip().isdecimal():
+        value = int(value)
+    if not isinstance(value, int) or isinstance(value, bool) or value <= 0:
+        return None
+    return value
+
+
+def _use_tool(tool: Dict[str, Any]) -> Dict[str, Any]:
+    """tool_choice forcing the model to call the given composer tool."""
+    return {"type": "tool", "name": tool["name"]}
+
+
+def _decode_drum_steps(steps: Any) -> Optional[List[bool]]:
+    """
+    Step string from create_drum_pattern ("x" hit, "." rest, "|" and spaces ignored)
+    as one bool per 16th note, or None if it contains anything else.
+    """
+    if not isinstance(steps, str):
+        return None
+    pattern = []
+    for step in steps:
+        if step in _DRUM_HIT_STEPS:
+            pattern.append(True)
+        elif step in _DRUM_REST_STEPS:
+            pattern.append(False)
+        elif step not in _DRUM_STEP_SEPARATORS:
+            return None
+    return pattern
+
+
+# The public soundfont catalogue rarely changes, so it is reused across compositions
+SOUNDFONT_CACHE_TTL_SECONDS = 60
+SoundfontCatalogue = Tuple[List[Dict[str, Any]], List[str], Dict[str, Dict[str, Any]]]
+_soundfont_cache: Optional[Tuple[float, SoundfontCatalogue]] = None
+# Concurrent compositions on a cold cache share a single fetch
+_soundfont_cache_lock = asyncio.Lock()
+
+
+async def _get_public_soundfonts_cached() -> SoundfontCatalogue:
+    """
+    Public soundfonts with their names and a name -> soundfont map, refreshed at most
+    every SOUNDFONT_CACHE_TTL_SECONDS.
+    """
+    global _soundfont_cache
+    async with _soundfont_cache_lock:
+        now = time.monotonic()
+        if _soundfont_cache and now - _soundfont_cache[0] < SOUNDFONT_CACHE_TTL_SECONDS:
+            return _soundfont_cache[1]
+
+        soundfonts = await soundfont_service.get_public_soundfonts()
+        catalogue = (
+            soundfonts,
+            [sf["name"] for sf in soundfonts],
+            {sf["name"]: sf for sf in soundfonts},
+        )
+        # An empty list is what the service returns on errors, so don't keep it
+        if soundfonts:
+            _soundfont_cache = (now, catalogue)
+        return catalogue
+
+
+# The drum sample catalogue is global as well and cached the same way
+DRUM_SAMPLE_CACHE_TTL_SECONDS = 60
+DrumSampleCatalogue = Tuple[
+    List[DrumSamplePublicRead], List[str], Dict[str, DrumSamplePublicRead]
+]
+_drum_sample_cache: Optional[Tuple[float, DrumSampleCatalogue]] = None
+_drum_sample_cache_lock = asyncio.Lock()
+
+
+async def _get_drum_samples_cached(
+    drum_sample_service: DrumSampleService,
+) -> DrumSampleCatalogue:
+    """
+    All drum samples with their display names and a name -> sample map, refreshed at
+    most every DRUM_SAMPLE_CACHE_TTL_SECONDS.
+    """
+    global _drum_sample_cache
+    async with _drum_sample_cache_lock:
+        now = time.monotonic()
+        if (
+            _drum_sample_cache
+            and now - _drum_sample_cache[0] < DRUM_SAMPLE_CACHE_TTL_SECONDS
+        ):
+            return _drum_sample_cache[1]
+
+        drum_samples = await drum_sample_service.get_all_samples()
+        catalogue = (
+            drum_samples,
+            [ds.display_name for ds in drum_samples],
+            {ds.display_name: ds for ds in drum_samples},
+        )
+        if drum_samples:
+            _drum_sample_cache = (now, catalogue)
+        return catalogue
+
+
+@lru_cache(maxsize=512)
+def _get_note_probabilities_json(chord_progression: str, key: str) -> str:
+    """
+    Serialized chord analysis used to guide melody note selection.
+    The analysis is deterministic for a given progression and key, and progressions
+    repeat often, so the chord parsing, the music21 work and the JSON encoding are
+    all cached on the raw progression string.
+    """
+    # music21 spells flats with "-" (e.g. "Bb" -> "B-")
+    chord_names = [
+        chord.strip().replace("b", "-")
+        for chord in _CHORD_SEPARATOR_RE.split(chord_progression)
+        if chord.strip()
+    ]
+    # Compact separators: the JSON is only read by the model, and indentation
+    # roughly doubles its prompt tokens
+    return json.dumps(
+        analyze_chord_progression(chord_names, key), separators=(",", ":")
+    )
+
+
+@lru_cache(maxsize=32)
+def _get_mode_intervals(mode: str) -> Tuple[int, ...]:
+    """
+    Allowed intervals for a mode, falling back to major for unknown modes.
+    Each lookup builds a music21 scale and modes come from a small set, so both
+    the result and the fallback are cached (as a tuple, since it is shared).
+    """
+    try:
+        return tuple(get_mode_intervals(mode))
+    except ValueError as e:
+        logger.warning(
+            "Could not determine intervals for mode '%s': %s. Using major scale intervals.",
+            mode,
+            e,
+        )
+        return tuple(get_mode_intervals("major"))
+
 
-@dataclass
+@dataclass(slots=True)
 class Instrument:
     id: str
     name: str
     description: str
     soundfont_name: str
     storage_key: str
+    category: str = ""  # Soundfont category from the public catalogue
     role: str = ""  # For tracking the instrument's role in the composition (melody, chords, etc.)
 
+    @property
+    def display_name(self) -> str:
+        """Matches InstrumentFileRead, which the midi transforms read the track name from"""
+        return self.name
+
     def to_dict(self) -> Dict[str, Any]:
         """Convert instrument to a dictionary for serialization"""
         return {
@@ -72,7 +288,7 @@ class Instrument:
         }
 
 
-@dataclass
+@dataclass(slots=True)
 class MusicalParams:
     key: str = ""
     mode: str = ""
@@ -87,25 +303,46 @@ class MusicalParams:
     chords: Optional[Any] = None
     melody_instrument: Optional[Instrument] = None
     chords_instrument: Optional[Instrument] = None
+    melody_instrument_suggestion: str = ""
+    chords_instrument_suggestion: str = ""
     drum_sounds: Optional[List[DrumSamplePublicRead]] = None
 
 
-class MusicGenService:
-    def __init__(self):
-        self.researcher = MusicResearcher()
-        self.anthropic_client = anthropic.Anthropic(
-            api_key=os.getenv("ANTHROPIC_API_KEY")
+class MusicComposition:
+    """
+    One composition: its conversations, catalogues, musical parameters and selected
+    instruments. MusicGenService creates one per compose_music call, so concurrent
+    compositions share none of this state.
+    """
+
+    def __init__(self, researcher: MusicResearcher):
+        self.researcher = researcher
+        self.anthropic_client2 = AnthropicClient(
+            system_prompt=get_ai_composer_agent_initial_system_prompt()
+        )
+        # Melody and drums each get their own conversation: they run concurrently, and
+        # each turn only resends its own phase's history instead of every earlier one
+        self.melody_composer = AnthropicClient(
+            system_prompt=get_ai_composer_agent_initial_system_prompt()
         )
-        self.anthropic_client2 = AnthropicClient()
-        self.melody_composer = AnthropicClient()
-        self.chord_composer = AnthropicClient()
-        self.model = os.getenv("MODEL_ID")
+        self.drum_composer = AnthropicClient(
+            system_prompt=get_ai_composer_agent_initial_system_prompt()
+        )
+        self.fast_model = FAST_MODEL_ID
         self.musical_params = MusicalParams()
         self.available_soundfonts = []
+        self.soundfont_names: List[str] = []
+        self.soundfont_map: Dict[str, Dict[str, Any]] = {}
         self.selected_instruments: List[Instrument] = []
+        # First selected instrument per role, and every selected soundfont name
+        self.instruments_by_role: Dict[str, Instrument] = {}
+        self._selected_names: Set[str] = set()
         self.drum_sounds: List[DrumSamplePublicRead] = []
+        self.drum_sample_names: List[str] = []
+        self.drum_sample_map: Dict[str, DrumSamplePublicRead] = {}
+        self.composition_context = ""
 
-    async def compose_music(
+    async def compose(
         self, prompt: str, queue: SSEQueueManager, session: Session
     ) -> Dict[str, Any]:
         _drum_file_repository = get_drum_sample_public_repository(session)
@@ -115,37 +352,61 @@ class MusicGenService:
             "Starting research...",
             "Doing research online to find the best musical parameters...",
         )
+        # Drum research doesn't depend on the parameters, so it runs with the rest
         (
             research_result,
             chord_research_result,
-            self.available_soundfonts,
+            drum_research_result,
+            (self.available_soundfonts, self.soundfont_names, self.soundfont_map),
         ) = await asyncio.gather(
             self.researcher.enhance_description(prompt),
             self.researcher.research_chord_progression(prompt),
-            soundfont_service.get_public_soundfonts(),
+            self.researcher.research_drum_sounds(prompt),
+            _get_public_soundfonts_cached(),
         )
+        logger.info("Drum result: %s", drum_research_result)
 
-        self.drum_sounds = await drum_sample_service.get_all_samples()
+        (
+            self.drum_sounds,
+            self.drum_sample_names,
+            self.drum_sample_map,
+        ) = await _get_drum_samples_cached(drum_sample_service)
 
-        await self._determine_musical_parameters(
+        await self._determine_params_and_instruments(
             prompt, research_result, chord_research_result, queue
         )
-
-        await self._select_instruments_via_llm(queue)
-
-        await self._generate_chords(queue)
-
-        # Generate melody
-        await self._generate_melody(prompt, queue)
-
-        # Get drum sounds
-        drum_result = await self.researcher.research_drum_sounds(prompt)
-        logger.info(f"Drum result: {drum_result}")
-
-        await self._select_drum_sounds(drum_result, queue)
-
-        # Generate drum beat *after* selecting sounds
-        await self._generate_drum_beat(queue)
+        if not self.selected_instruments:
+            # Chords and melody both need an instrument; fail here instead of
+            # letting each stage log an error and return nothing
+            raise ValueError("No instruments available for the composition.")
+
+        # Fixed from here on, so the phase conversations carry it in their system
+        # prompt (cached with it) instead of repeating it in every message
+        self.composition_context = self._get_composition_context(prompt)
+        phase_system_prompt = "\n".join(
+            (get_ai_composer_agent_initial_system_prompt(), self.composition_context)
+        )
+        self.melody_composer.set_system_prompt(phase_system_prompt)
+        self.drum_composer.set_system_prompt(phase_system_prompt)
+
+        # Chords are rendered locally from the chosen progression and the drums have
+        # their own conversation, so all three run while the melody is in flight.
+        # A failed part is reported and left out; cancelling the composition (e.g. the
+        # client disconnecting) cancels every part's requests together.
+        async with asyncio.TaskGroup() as stages:
+            stages.create_task(
+                self._run_stage("chords", self._generate_chords(queue), queue)
+            )
+            stages.create_task(
+                self._run_stage("melody", self._generate_melody(queue), queue)
+            )
+            stages.create_task(
+                self._run_stage(
+                    "drums",
+                    self._compose_drums(drum_research_result, queue),
+                    queue,
+                )
+            )
 
         instruments = []
         if self.musical_params.melody:
@@ -163,69 +424,179 @@ class MusicGenService:
             "chord_progression": self.musical_params.chord_progression,
         }
 
-    async def _get_drum_sounds(self, prompt: str, queue: SSEQueueManager):
-        """Gets the drum sounds using an LLM."""
-        logger.debug("Getting drum sounds...")
-        drum_result = await self.researcher.research_drum_sounds(prompt)
-        logger.info(f"Drum result: {drum_result}")
-        return drum_result
+    def _get_composition_context(self, prompt: str) -> str:
+        """The description and musical parameters every composition phase works from."""
+        return f"""Composition details:
+Description: {prompt}
+Key: {self.musical_params.key} {self.musical_params.mode}
+Tempo: {self.musical_params.bpm} BPM
+Chord Progression: {self.musical_params.chord_progression}
+"""
+
+    @staticmethod
+    async def _run_stage(name: str, stage: Awaitable[Any], queue: SSEQueueManager):
+        """Awaits one composition part, reporting a failure instead of raising."""
+        try:
+            await stage
+        except Exception as e:
+            logger.error("Composition stage %s failed: %s", name, e, exc_info=True)
+            await queue.error(f"Failed to generate {name}.")
+
+    async def _compose_drums(self, drum_research_result: str, queue: SSEQueueManager):
+        """Selects and writes the drums in the drum conversation."""
+        await self._select_drum_sounds(drum_research_result, queue)
+
+        # Generate drum beat *after* selecting sounds
+        await self._generate_drum_beat(drum_research_result, queue)
 
-    async def _determine_musical_parameters(
+    @staticmethod
+    def _is_tool_input(
+        tool_use_json: Optional[Dict[str, Any]], tool: Dict[str, Any]
+    ) -> bool:
+        """Whether `tool_use_json` has every field `tool` requires."""
+        required = tool["input_schema"].get("required", [])
+        return bool(tool_use_json) and all(key in tool_use_json for key in required)
+
+    async def _force_tool_use(
+        self,
+        tool: Dict[str, Any],
+        queue: Optional[SSEQueueManager],
+        model: Optional[str] = None,
+        client: Optional[AnthropicClient] = None,
+        tools: Optional[List[Dict[str, Any]]] = None,
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Follow-up turn forcing a call of `tool` the reasoning turn did not make.
+        `tools` is the conversation's tool list (just `tool` unless given).
+        """
+        logger.warning(
+            "No %s call in the reasoning turn, requesting it explicitly", tool["name"]
+        )
+        client = client or self.anthropic_client2
+        _, tool_use_json = await client.send_message_async(
+            f"Now use the {tool['name']} tool to confirm your choices.",
+            queue,
+            stream=True,
+            tools=tools or [tool],
+            tool_choice=_use_tool(tool),
+            model=model,
+        )
+        return tool_use_json
+
+    async def _reason_and_use_tool(
+        self,
+        message: str,
+        tool: Dict[str, Any],
+        queue: Optional[SSEQueueManager],
+        model: Optional[str] = None,
+        client: Optional[AnthropicClient] = None,
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Single turn in which the model explains its reasoning and then calls `tool`.
+        Falls back to a forced call of `tool` only when that turn did not produce its input.
+        Runs in the main composer conversation unless another `client` is given.
+        """
+        client = client or self.anthropic_client2
+        # Only the tool this turn is for, so the model can't pick another one
+        await client.send_message_async(
+            message,
+            queue,
+            stream=True,
+            tools=[tool],
+            tool_choice=_AUTO_TOOL_CHOICE,
+            model=model,
+        )
+
+        # None when the model only wrote its reasoning
+        tool_use_json = client.last_tool_uses.get(tool["name"])
+        if self._is_tool_input(tool_use_json, tool):
+            return tool_use_json
+        return await self._force_tool_use(tool, queue, model=model, client=client)
+
+    async def _determine_params_and_instruments(
         self,
         prompt: str,
         research_result: str,
         chord_research_result: str,
         queue: SSEQueueManager,
     ):
-        """Determines key, mode, BPM, chord progression, and suggested instruments using an LLM."""
-        logger.debug("Determining musical parameters...")
-        system_prompt = get_ai_composer_agent_initial_system_prompt()
-        self.anthropic_client2.set_system_prompt(system_prompt)
+        """
+        Determines key, mode, BPM and chord progression and selects the instruments in one turn:
+        the model reasons about both, then calls determine_musical_parameters and
+        select_instruments in the same response. A call missing from it is forced afterwards.
+        """
+        logger.debug("Determining musical parameters and instruments...")
 
         message = f"""Based on this description: {prompt}
 
-I need you to determine the musical parameters (key, mode, BPM, melody instrument, chords instrument, and chord progression). 
+I need you to determine the musical parameters (key, mode, BPM, melody instrument, chords instrument, and chord progression) and then select specific instruments (soundfonts) for the composition.
 
 First, explain your reasoning for each parameter:
 1. What key would work best and why?
 2. What mode would complement this and why?
 3. What tempo (BPM) would capture the right feel and why?
 4. What chord progression would support this style and why?
-5. What melody instrument would work best and why? (Suggest a general type, not a specific soundfont yet)
-6. What chords instrument would work best and why? (Suggest a general type, not a specific soundfont yet)
+5. What melody instrument would work best and why? (Suggest a general type)
+6. What chords instrument would work best and why? (Suggest a general type)
+
+Then look through this list of available soundfonts and select specific ones that fit the roles (melody, chords), the instrument types you suggested and the overall style.
+Available Soundfonts: {", ".join(self.soundfont_names)}
+
+Explain your choices briefly for each role. You should select at least one instrument for melody and one for chords. Make sure they fit well together.
 
-After you've explained your choices, use the determine_musical_parameters tool to set these values.
+After you've explained your choices, use the determine_musical_parameters tool to set the musical parameters, and then the select_instruments tool to finalize the instruments.
 
-**IMPORTANT: Explain your reasoning for each parameter before using the tool.**
+**IMPORTANT: Explain your reasoning before using the tools.**
 
 Here is some research we've done on the description: {research_result} 
 And here is some research we've done on the chord progression: {chord_research_result}"""
 
         await self.anthropic_client2.send_message_async(
-            message, queue, stream=True, tools=[]
+            message,
+            queue,
+            stream=True,
+            tools=PARAMETER_TOOLS,
+            tool_choice=_AUTO_TOOL_CHOICE,
+            model=self.fast_model,
         )
-
-        message = """
-        Now use the "determine_musical_parameters" tool to set the musical parameters based on your previous reasoning.
-        """
-        _, tool_use_json = await self.anthropic_client2.send_message_async(
-            message, queue, stream=True, tools=[DETERMINE_MUSICAL_PARAMETERS_TOOL]
-        )
-
-        if not tool_use_json:
+        tool_uses = self.anthropic_client2.last_tool_uses
+        params_json = tool_uses.get(DETERMINE_MUSICAL_PARAMETERS_TOOL["name"])
+        selections_json = tool_uses.get(SELECT_INSTRUMENTS_TOOL["name"])
+
+        if not self._is_tool_input(params_json, DETERMINE_MUSICAL_PARAMETERS_TOOL):
+            params_json = await self._force_tool_use(
+                DETERMINE_MUSICAL_PARAMETERS_TOOL,
+                queue,
+                model=self.fast_model,
+                tools=PARAMETER_TOOLS,
+            )
+        if not params_json:
             raise ValueError("Failed to get musical parameters from LLM tool use.")
 
         self._set_musical_params(
-            tool_use_json.get("key"),
-            tool_use_json.get("mode"),
-            tool_use_json.get("chord_progression"),
-            tool_use_json.get("tempo"),
-            tool_use_json.get("melody_instrument"),
-            tool_use_json.get("chords_instrument"),
+            params_json.get("key"),
+            params_json.get("mode"),
+            params_json.get("chord_progression"),
+            params_json.get("tempo"),
+            params_json.get("melody_instrument"),
+            params_json.get("chords_instrument"),
         )
-        logger.info(f"Determined Musical Params: {self.musical_params}")
+        logger.info("Determined Musical Params: %s", self.musical_params)
         await queue.action(AssistantAction.change_bpm(value=self.musical_params.bpm))
 
+        if not self._is_tool_input(selections_json, SELECT_INSTRUMENTS_TOOL):
+            selections_json = await self._force_tool_use(
+                SELECT_INSTRUMENTS_TOOL,
+                queue,
+                model=self.fast_model,
+                tools=PARAMETER_TOOLS,
+            )
+        if not selections_json:
+            raise ValueError("Failed to get instrument selections from LLM tool use.")
+
+        self._process_instrument_selections(selections_json)
+        logger.info("Selected Instruments: %s", self.selected_instruments)
+
     async def _select_drum_sounds(
         self, drum_research_result: str, queue: SSEQueueManager
     ):
@@ -241,14 +612,14 @@ And here is some research we've done on the chord progression: {chord_research_r
             self.musical_params.drum_sounds = []
             return
 
-        # Create a list of names and a mapping for easy lookup
-        drum_sample_names = [ds.display_name for ds in self.drum_sounds]
-        drum_sound_map = {ds.display_name: ds for ds in self.drum_sounds}
+        # Built once with the cached catalogue
+        drum_sample_names = self.drum_sample_names
+        drum_sound_map = self.drum_sample_map
 
-        message = f"""Now we need to select specific drum sounds for the composition. 
+        message = f"""We need to select specific drum sounds for the composition.
 
-Look through this list of available drum sounds and select specific ones that fit the overall style and the description provided earlier. 
-Available Drum Sounds: {drum_sample_names} 
+Look through this list of available drum sounds and select specific ones that fit the overall style and the description. 
+Available Drum Sounds: {", ".join(drum_sample_names)} 
 
 Consider the genre of the description and select the most appropriate drum sounds (typically 4-5, like kick, snare, hi-hat, crash). Consider this research: {drum_research_result}
 
@@ -256,13 +627,9 @@ Explain your choices briefly for each drum sound you select.
 
 After explaining, use the select_drum_sounds tool to finalize your choices."""
 
-        await self.anthropic_client2.send_message_async(
-            message, queue, stream=True, tools=[]
-        )
-
-        message = "Now use the select_drum_sounds tool to confirm your drum sound selections based on your reasoning."
-        _, tool_use_json = await self.anthropic_client2.send_message_async(
-            message, queue, stream=True, tools=[SELECT_DRUM_SOUNDS_TOOL]
+        # The reasoning is not streamed: it would interleave with the melody's
+        tool_use_json = await self._reason_and_use_tool(
+            message, SELECT_DRUM_SOUNDS_TOOL, None, client=self.drum_composer
         )
 
         if not tool_use_json:
@@ -270,7 +637,7 @@ After explaining, use the select_drum_sounds tool to finalize your choices."""
             self.musical_params.drum_sounds = []
             return
 
-        logger.info(f"Drum Tool use JSON: {tool_use_json}")
+        logger.info("Drum Tool use JSON: %s", tool_use_json)
 
         selected_names_raw = tool_use_json.get("drum_sounds", [])
 
@@ -283,10 +650,11 @@ After explaining, use the select_drum_sounds tool to finalize your choices."""
                 if isinstance(parsed_list, list):
                     selected_names = parsed_list
                 else:
-                    logger.warning(f"Parsed drum_sounds is not a list: {parsed_list}")
+                    logger.warning("Parsed drum_sounds is not a list: %s", parsed_list)
             except json.JSONDecodeError:
                 logger.warning(
-                    f"Could not parse drum_sounds string: {selected_names_raw}. Attempting fallback if it's a single string."
+                    "Could not parse drum_sounds string: %s. Attempting fallback if it's a single string.",
+                    selected_names_raw,
                 )
                 # Fallback: Treat the raw string as a single potential drum name if parsing fails
                 selected_names = [selected_names_raw]
@@ -294,7 +662,7 @@ After explaining, use the select_drum_sounds tool to finalize your choices."""
             selected_names = selected_names_raw
         else:
             logger.warning(
-                f"Received unexpected type for drum_sounds: {type(selected_names_raw)}"
+                "Received unexpected type for drum_sounds: %s", type(selected_names_raw)
             )
 
         if not selected_names:
@@ -308,61 +676,21 @@ After explaining, use the select_drum_sounds tool to finalize your choices."""
         for name in selected_names:
             if name in drum_sound_map:
                 selected_drums.append(drum_sound_map[name])
-                logger.info(f"Selected drum sound: {name}")
+                logger.info("Selected drum sound: %s", name)
             else:
                 logger.warning(
-                    f"LLM selected drum sound '{name}' which is not in the available list."
+                    "LLM selected drum sound '%s' which is not in the available list.",
+                    name,
                 )
 
         self.musical_params.drum_sounds = selected_drums
-        logger.info(
-            f"Final selected drums ({len(self.musical_params.drum_sounds)}): {[ds.display_name for ds in self.musical_params.drum_sounds]}"
-        )
-
-    async def _select_instruments_via_llm(self, queue: SSEQueueManager):
-        """Selects specific soundfonts using an LLM based on available soundfonts and desired roles."""
-        logger.debug("Selecting instruments via LLM...")
-        soundfont_names = [sf["name"] for sf in self.available_soundfonts]
-
-        melody_suggestion = (
-            f"The suggested melody instrument type is: {self.musical_params.melody_instrument_suggestion}"
-            if self.musical_params.melody_instrument_suggestion
-            else ""
-        )
-        chords_suggestion = (
-            f"The suggested chords instrument type is: {self.musical_params.chords_instrument_suggestion}"
-            if self.musical_params.chords_instrument_suggestion
-            else ""
-        )
-
-        message = f"""Now we need to select specific instruments (soundfonts) for the composition. 
-        
-{melody_suggestion}
-{chords_suggestion}
-
-Look through this list of available soundfonts and select specific ones that fit the roles (melody, chords) and the overall style. 
-Available Soundfonts: {soundfont_names} 
-
-Explain your choices briefly for each role. You should select at least one instrument for melody and one for chords. Make sure they fit well together.
-
-After explaining, use the select_instruments tool to finalize your choices."""
-
-        await self.anthropic_client2.send_message_async(
-            message, queue, stream=True, tools=[]
-        )
-
-        message = (
-            "Now use the select_instruments tool to confirm your instrument selections."
-        )
-        _, tool_use_json = await self.anthropic_client2.send_message_async(
-            message, queue, stream=True, tools=[SELECT_INSTRUMENTS_TOOL]
-        )
-
-        if not tool_use_json:
-            raise ValueError("Failed to get instrument selections from LLM tool use.")
-
-        self._process_instrument_selections(tool_use_json)
-        logger.info(f"Selected Instruments: {self.selected_instruments}")
+        # The name list exists only for this log line
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(
+                "Final selected drums (%s): %s",
+                len(selected_drums),
+                [ds.display_name for ds in selected_drums],
+            )
 
     def _process_instrument_selections(self, tool_use_args: Dict[str, Any]):
         """Processes the instrument selections from the LLM tool use."""
@@ -379,9 +707,9 @@ After explaining, use the select_instruments tool to finalize your choices."""
                 )
             return
 
-        soundfont_map = {sf["name"]: sf for sf in self.available_soundfonts}
+        soundfont_map = self.soundfont_map
 
-        self.selected_instruments = []
+        self._clear_selected_instruments()
         for selection in instrument_selections:
             instrument_name = selection.get("instrument_name")
             role = selection.get("role")
@@ -392,24 +720,17 @@ After explaining, use the select_instruments tool to finalize your choices."""
                 self._add_selected_instrument(soundfont_data, role, explanation)
             else:
                 logger.warning(
-                    f"LLM selected instrument '{instrument_name}' not found in available soundfonts."
+                    "LLM selected instrument '%s' not found in available soundfonts.",
+                    instrument_name,
                 )
 
-        has_melody = any(inst.role == "melody" for inst in self.selected_instruments)
-        has_chords = any(inst.role == "chords" for inst in self.selected_instruments)
-
-        if not has_melody and self.available_soundfonts:
+        if "melody" not in self.instruments_by_role and self.available_soundfonts:
             logger.warning("No melody instrument selected, assigning fallback.")
             fallback_melody = next(
                 (
                     sf
                     for sf in self.available_soundfonts
-                    if sf["name"]
-                    not in [
-                        inst.name
-                        for inst in self.selected_instruments
-                        if inst.role == "chords"
-                    ]
+                    if sf["name"] not in self._selected_names
                 ),
                 self.available_soundfonts[0],
             )
@@ -417,18 +738,13 @@ After explaining, use the select_instruments tool to finalize your choices."""
                 fallback_melody, "melody", "Fallback for missing melody role"
             )
 
-        if not has_chords and self.available_soundfonts:
+        if "chords" not in self.instruments_by_role and self.available_soundfonts:
             logger.warning("No chords instrument selected, assigning fallback.")
             fallback_chords = next(
                 (
                     sf
                     for sf in self.available_soundfonts
-                    if sf["name"]
-                    not in [
-                        inst.name
-                        for inst in self.selected_instruments
-                        if inst.role == "melody"
-                    ]
+                    if sf["name"] not in self._selected_names
                 ),
                 self.available_soundfonts[0],
             )
@@ -436,15 +752,20 @@ After explaining, use the select_instruments tool to finalize your choices."""
                 fallback_chords, "chords", "Fallback for missing chords role"
             )
 
+    def _clear_selected_instruments(self):
+        """Clears the selected instruments and their role and name indexes."""
+        self.selected_instruments = []
+        self.instruments_by_role = {}
+        self._selected_names = set()
+
     def _add_selected_instrument(
         self, soundfont_data: Dict[str, Any], role: str, description: str
     ):
         """Adds a selected instrument to the list, avoiding duplicates."""
-        if any(
-            inst.name == soundfont_data["name"] for inst in self.selected_instruments
-        ):
+        if soundfont_data["name"] in self._selected_names:
             logger.debug(
-                f"Instrument '{soundfont_data['name']}' already selected, skipping duplicate add."
+                "Instrument '%s' already selected, skipping duplicate add.",
+                soundfont_data["name"],
             )
             return
 
@@ -454,14 +775,24 @@ After explaining, use the select_instruments tool to finalize your choices."""
             description=description,
             soundfont_name=soundfont_data["name"],
             storage_key=soundfont_data["storage_key"],
+            category=soundfont_data.get("category") or "",
             role=role,
         )
         self.selected_instruments.append(instrument)
-        logger.info(f"Added instrument: {instrument.name} with role: {instrument.role}")
+        self.instruments_by_role.setdefault(role, instrument)
+        self._selected_names.add(instrument.name)
+        logger.info(
+            "Added instrument: %s with role: %s", instrument.name, instrument.role
+        )
 
     async def _generate_chords(self, queue: SSEQueueManager):
         """Generates the chord progression MIDI data."""
         logger.debug("Generating chords...")
+        # Runs concurrently with the melody stage, so it announces its own stage
+        await queue.stage(
+            "Generating chords...",
+            f"Voicing the {self.musical_params.chord_progression} progression...",
+        )
         try:
             chords_result = await self._handle_create_chords(queue=queue)
             if chords_result:
@@ -469,10 +800,12 @@ After explaining, use the select_instruments tool to finalize your choices."""
             else:
                 logger.warning("Chord generation did not return results.")
         except Exception as e:
-            logger.error(f"Error generating chord progression: {str(e)}", exc_info=True)
+            logger.error("Error generating chord progression: %s", e, exc_info=True)
             self.musical_params.chords = None
 
-    async def _generate_drum_beat(self, queue: SSEQueueManager):
+    async def _generate_drum_beat(
+        self, drum_research_result: str, queue: SSEQueueManager
+    ):
         """Generates the drum beat MIDI data."""
         logger.debug("Generating drum beat...")
         await queue.stage(
@@ -485,58 +818,88 @@ After explaining, use the select_instruments tool to finalize your choices."""
             logger.warning("No drum sounds selected, skipping drum beat generation.")
             return
 
-        # Convert UUID to string for JSON serialization
-        drum_info = [
-            {"id": str(ds.id), "name": ds.display_name} for ds in selected_drums
-        ]
-        drum_names = [ds["name"] for ds in drum_info]
-
-        message = f"""We need to create drum patterns for the composition.
-Key: {self.musical_params.key} {self.musical_params.mode}
-Tempo: {self.musical_params.bpm} BPM
-Style based on original prompt.
-
-Selected Drum Sounds: {drum_names}
-
-For EACH of the following drum sounds, create a rhythmic pattern:
-{json.dumps(drum_info, indent=2)}
+        drum_names = [ds.display_name for ds in selected_drums]
+        # Every pattern is written from the drum conversation's context: its system
+        # prompt, the drum research and the reasoning that chose the sounds
+        selection_reasoning = next(
+            (
+                m["content"]
+                for m in self.drum_composer.get_messages()
+                if m["role"] == "assistant"
+            ),
+            "",
+        )
+        pattern_system_prompt = f"""{self.drum_composer.system_prompt}
+Drum research: {drum_research_result}
+Why these drum sounds were chosen: {selection_reasoning}"""
+
+        async def write_pattern(
+            drum_sample: DrumSamplePublicRead,
+        ) -> Optional[Dict[str, Any]]:
+            """Writes the 32-step pattern of one drum sound."""
+            other_drums = ", ".join(
+                name for name in drum_names if name != drum_sample.display_name
+            )
+            message = f"""We need to create the drum pattern for the {drum_sample.display_name} in the composition.
 
-Each pattern MUST be a JSON array of exactly 32 boolean values (true/false), representing 16th notes over 2 bars (in 4/4 time).
-'true' means the drum hits on that 16th note step, 'false' means silence.
+The other drum sounds in the beat are: {other_drums}. Give the {drum_sample.display_name} the role it usually has next to them (e.g., kick provides the main pulse, snare hits on 2 and 4, hi-hat provides 16th note rhythm).
 
-Describe the overall feel of the drum beat you are creating and explain the role of each drum sound's pattern (e.g., kick provides the main pulse, snare hits on 2 and 4, hi-hat provides 16th note rhythm).
+The pattern MUST be a string of exactly 32 steps, one per 16th note over 2 bars (in 4/4 time).
+'x' means the drum hits on that 16th note step, '.' means silence. For example, a kick on every beat is "x...x...x...x...x...x...x...x...".
 
-After your explanation, use the 'create_drum_beat' tool to provide the patterns.
-"""
+Use the 'create_drum_pattern' tool to provide the pattern."""
 
-        try:
-            # Send message asking for reasoning + tool use prompt
-            await self.anthropic_client2.send_message_async(
-                message, queue, stream=True, tools=[]
+            # One request per conversation, sent alongside the other drums': nothing
+            # would ever read a cache breakpoint
+            composer = AnthropicClient(
+                system_prompt=pattern_system_prompt,
+                cache_system=False,
+                cache_history=False,
             )
-
-            # Send message explicitly asking for the tool use
-            tool_prompt = f"Now, use the 'create_drum_beat' tool to generate the 32-step boolean patterns for each of the selected drum sounds: {drum_names}. Ensure each pattern is exactly 32 booleans long."
-            _, tool_use_json = await self.anthropic_client2.send_message_async(
-                tool_prompt, queue, stream=True, tools=[CREATE_DRUM_BEAT_TOOL]
+            _, tool_use_json = await composer.send_message_async(
+                message,
+                None,
+                stream=True,
+                tools=[CREATE_DRUM_PATTERN_TOOL],
+                tool_choice=_use_tool(CREATE_DRUM_PATTERN_TOOL),
             )
+            if not self._is_tool_input(tool_use_json, CREATE_DRUM_PATTERN_TOOL):
+                logger.warning(
+                    "No drum pattern received for %s, skipping.",
+                    drum_sample.display_name,
+                )
+                return None
+            # Patterns that don't decode are kept as-is so the checks below reject them
+            steps = tool_use_json["pattern"]
+            return {
+                "drum_sound_id": str(drum_sample.id),
+                "pattern": _decode_drum_steps(steps) or steps,
+            }
 
-            if not tool_use_json or "drum_beats" not in tool_use_json:
+        try:
+            # Output decoding dominates latency, so each drum's pattern is written by
+            # its own concurrent request instead of one request writing them all
+            drum_patterns = [
+                beat_data
+                for beat_data in await asyncio.gather(
+                    *(write_pattern(ds) for ds in selected_drums)
+                )
+                if beat_data
+            ]
+            if not drum_patterns:
                 logger.error(
                     "Failed to get valid drum beat patterns from LLM tool use."
                 )
                 raise ValueError(
                     "LLM response did not contain valid JSON for drum beats using the tool."
                 )
-
-            drum_patterns = tool_use_json["drum_beats"]
-            logger.info(f"Received {len(drum_patterns)} drum patterns from LLM.")
+            logger.info("Received %s drum patterns from LLM.", len(drum_patterns))
 
             # Create a map of string IDs to drum samples for easier lookup
             drum_sound_map = {str(ds.id): ds for ds in selected_drums}
 
-            logger.info(f"Drum patterns: {drum_patterns}")
-            logger.info(f"Drum sound map keys: {list(drum_sound_map.keys())}")
+            logger.info("Drum patterns: %s", drum_patterns)
+            logger.info("Drum sound map keys: %s", drum_sound_map.keys())
             drum_track_id = uuid.uuid4()
             drum_track = DrumTrackRead(
                 id=drum_track_id,
@@ -544,34 +907,39 @@ After your explanation, use the 'create_drum_beat' tool to provide the patterns.
             )
             for beat_data in drum_patterns:
                 drum_sound_id = beat_data.get("drum_sound_id")
-                pattern = beat_data.get("pattern") * 2
-
-                logger.info(f"Drum sound ID: {drum_sound_id}")
-                logger.info(f"Pattern: {pattern}")
+                pattern = beat_data.get("pattern")
 
-                notes = transform_drum_beats_to_midi_format(pattern)
-                logger.info(f"Notes: {notes}")
+                logger.info("Drum sound ID: %s", drum_sound_id)
+                logger.info("Pattern: %s", pattern)
 
+                # Validated on the 32 steps the model wrote, before any conversion work
                 if (
                     not drum_sound_id
                     or not isinstance(pattern, list)
-                    or len(pattern) != 64
+                    or len(pattern) != 32
                 ):
                     logger.warning(
-                        f"Invalid drum beat data received: {beat_data}, skipping."
+                        "Invalid drum beat data received: %s, skipping.", beat_data
                     )
                     continue
 
-                if not all(isinstance(p, bool) for p in pattern):
+                if not all(p is True or p is False for p in pattern):
                     logger.warning(
-                        f"Invalid pattern format (non-boolean values) for drum sound ID {drum_sound_id}, skipping."
+                        "Invalid pattern format (non-boolean values) for drum sound ID %s, skipping.",
+                        drum_sound_id,
                     )
                     continue
 
+                # The 2-bar pattern is looped to fill 4 bars
+                notes = transform_drum_beats_to_midi_format(pattern * 2)
+                logger.info("Notes: %s", notes)
+
                 if drum_sound_id in drum_sound_map:
                     drum_sample = drum_sound_map[drum_sound_id]
                     logger.info(
-                        f"Adding drum track for {drum_sample.display_name} (ID: {drum_sound_id})"
+                        "Adding drum track for %s (ID: %s)",
+                        drum_sample.display_name,
+                        drum_sound_id,
                     )
                     sampler_track_id = uuid.uuid4()
                     drum_track.sampler_tracks.append(
@@ -594,43 +962,38 @@ After your explanation, use the 'create_drum_beat' tool to provide the patterns.
                     drum_track.sampler_track_ids.append(sampler_track_id)
                 else:
                     logger.warning(
-                        f"Drum sound ID '{drum_sound_id}' from LLM response not found in selected drums."
+                        "Drum sound ID '%s' from LLM response not found in selected drums.",
+                        drum_sound_id,
                     )
 
-            logger.info(f"Successfully processed and added drum track: {drum_track}")
+            logger.info("Successfully processed and added drum track: %s", drum_track)
 
             await queue.action(AssistantAction.add_drum_track(track=drum_track))
 
         except Exception as e:
-            logger.error(f"Error during drum beat generation: {str(e)}")
-            logger.error(f"Stack trace: {traceback.format_exc()}")
+            logger.error("Error during drum beat generation: %s", e)
+            logger.error("Stack trace: %s", traceback.format_exc())
             # Optionally send an error status via SSE
             await queue.error("Failed to generate drum beat.")
 
-    async def _generate_melody(self, prompt: str, queue: SSEQueueManager):
+    async def _generate_melody(self, queue: SSEQueueManager):
         """Generates the melody MIDI data using an LLM."""
         logger.debug("Generating melody...")
 
-        melody_instrument = next(
-            (inst for inst in self.selected_instruments if inst.role == "melody"), None
-        )
+        melody_instrument = self.instruments_by_role.get("melody")
         if not melody_instrument:
             logger.error("Cannot generate melody: No melody instrument selected.")
             return
 
-        message = f"""Describe a suitable melody for the following description: '{prompt}'.
-Consider the key ({self.musical_params.key} {self.musical_params.mode}), tempo ({self.musical_params.bpm} BPM), chord progression ({self.musical_params.chord_progression}), and the chosen melody instrument ({melody_instrument.name}). 
+        message = f"""Describe a suitable melody for the composition's description.
+Consider its key, tempo, chord progression, and the chosen melody instrument ({melody_instrument.name}). 
 Describe the melody in terms of: mood, rhythm, musical style, and overall character.
 Then, use the create_melody tool to generate the notes."""
 
-        await self.anthropic_client2.send_message_async(
-            message, queue, stream=True, tools=[]
-        )
-
-        message = f"Now use the create_melody tool to generate the melody notes based on your description and the established musical parameters (Key: {self.musical_params.key} {self.musical_params.mode}, Tempo: {self.musical_params.bpm} BPM, Chord Progression: {self.musical_params.chord_progression}, Melody Instrument: {melody_instrument.name})."
-
-        _, tool_use_json = await self.anthropic_client2.send_message_async(
-            message, queue, stream=True, tools=[CREATE_MELODY_TOOL]
+        # The system prompt and message carry everything the melody needs from the
+        # earlier phases
+        tool_use_json = await self._reason_and_use_tool(
+            message, CREATE_MELODY_TOOL, queue, client=self.melody_composer
         )
 
         if not tool_use_json:
@@ -639,10 +1002,12 @@ Then, use the create_melody tool to generate the notes."""
             )
 
         try:
-            await self._handle_create_melody(tool_use_json, queue)
+            await self._handle_create_melody(
+                tool_use_json, melody_instrument, queue
+            )
             logger.info("Successfully generated melody.")
         except Exception as e:
-            logger.error(f"Error generating melody: {str(e)}", exc_info=True)
+            logger.error("Error generating melody: %s", e, exc_info=True)
             self.musical_params.melody = None
 
     async def _handle_create_chords(
@@ -670,36 +1035,32 @@ Then, use the create_melody tool to generate the notes."""
             )
             return None
 
-        chord_instrument = next(
-            (inst for inst in self.selected_instruments if inst.role == "chords"), None
-        )
+        chord_instrument = self.instruments_by_role.get("chords")
 
         if not chord_instrument:
             logger.error("No 'chords' role instrument selected for chord progression")
             return None
 
         logger.info(
-            f"Generating chord progression: '{chord_progression}' in {key} {mode} using {chord_instrument.name}"
+            "Generating chord progression: '%s' in %s %s using %s",
+            chord_progression,
+            key,
+            mode,
+            chord_instrument.name,
         )
 
         try:
-            if isinstance(chord_progression, str):
-                processed_chord_progression = re.sub(
-                    r"[,\s]+", "-", chord_progression
-                ).strip("-")
-            else:
-                logger.error(f"Invalid chord progression format: {chord_progression}")
-                return None
-
+            # Already normalized to "A-B-C" form by _set_musical_params
             result = transform_chord_progression_to_instrument_format(
-                chord_progression=processed_chord_progression,
+                chord_progression=chord_progression,
                 instrument=chord_instrument,
                 key=key,
             )
 
             if not result or "notes" not in result or not result["notes"]:
                 logger.error(
-                    f"Chord transformation returned empty or invalid result for progression '{processed_chord_progression}'"
+                    "Chord transformation returned empty or invalid result for progression '%s'",
+                    chord_progression,
                 )
                 return None
 
@@ -707,7 +1068,7 @@ Then, use the create_melody tool to generate the notes."""
 
             result["part_type"] = "chords"
             result["description"] = (
-                f"Chord progression {processed_chord_progression} in {key} {mode}"
+                f"Chord progression {chord_progression} in {key} {mode}"
             )
 
             # await queue.action(AssistantAction.add_midi_track(
@@ -732,31 +1093,43 @@ Then, use the create_melody tool to generate the notes."""
                             file_size=0,  # TODO: Fix this later
                             category="chords",
                             is_public=True,
-                            description=f"Chord progression {processed_chord_progression} in {key} {mode}",
+                            description=f"Chord progression {chord_progression} in {key} {mode}",
                         ),
                     )
                 )
             )
 
             logger.info(
-                f"Generated chord progression with {len(result.get('notes', []))} notes"
+                "Generated chord progression with %s notes",
+                len(result.get("notes", [])),
             )
             return result
 
         except Exception as e:
-            logger.error(f"Error during chord transformation/MIDI generation: {str(e)}")
-            logger.error(f"Stack trace: {traceback.format_exc()}")
+            logger.error("Error during chord transformation/MIDI generation: %s", e)
+            logger.error("Stack trace: %s", traceback.format_exc())
             return None
 
     async def _handle_create_melody(
-        self, args: Dict[str, Any], queue: SSEQueueManager
+        self,
+        args: Dict[str, Any],
+        melody_instrument: Instrument,
+        queue: SSEQueueManager,
     ) -> Optional[Dict[str, Any]]:
-        """Handles the melody generation process based on LLM tool output and musical parameters."""
+        """
+        Handles the melody generation process based on LLM tool output and musical parameters.
+        `melody_instrument` is the 'melody' role instrument already resolved by _generate_melody.
+        """
 
         instrument_name_llm = args.get("instrument_name", "")
         description = args.get("description", "")
-        duration_beats = args.get("duration_beats", self.musical_params.duration_beats)
-        duration_bars = args.get("duration_bars", self.musical_params.duration_bars)
+        # The tool input is unchecked; the length drives the segment ranges below
+        duration_bars = min(
+            _parse_positive_int(args.get("duration_bars"))
+            or self.musical_params.duration_bars,
+            _MAX_MELODY_BARS,
+        )
+        duration_beats = duration_bars * _BEATS_PER_BAR
         mood = args.get("mood", "")
         tempo_character = args.get("tempo_character", "")
         rhythm_type = args.get("rhythm_type", "")
@@ -775,27 +1148,16 @@ Then, use the create_melody tool to generate the notes."""
             )
             return None
 
-        melody_instrument = next(
-            (inst for inst in self.selected_instruments if inst.role == "melody"), None
-        )
-        if not melody_instrument:
-            logger.error(
-                "Cannot generate melody: No 'melody' role instrument selected."
-            )
-            return None
-
         logger.info(
-            f"Using instrument '{melody_instrument.name}' for melody generation."
+            "Using instrument '%s' for melody generation.", melody_instrument.name
         )
         if instrument_name_llm and instrument_name_llm != melody_instrument.name:
             logger.warning(
-                f"LLM suggested melody instrument '{instrument_name_llm}' in create_melody tool, but using selected instrument '{melody_instrument.name}'."
+                "LLM suggested melody instrument '%s' in create_melody tool, but using selected instrument '%s'.",
+                instrument_name_llm,
+                melody_instrument.name,
             )
 
-        detailed_description = (
-            f"Generate a melody for the instrument '{melody_instrument.name}'. "
-        )
-        detailed_description += description
         structured_params = {
             "key": key,
             "mode": mode,
@@ -807,20 +1169,38 @@ Then, use the create_melody tool to generate the notes."""
             "melodic_character": melodic_character,
             "chord_progression": chord_progression,
         }
-        detailed_description += ". Parameters: " + ", ".join(
-            f"{k}='{v}'" for k, v in structured_params.items() if v
+        parameters = ", ".join(f"{k}='{v}'" for k, v in structured_params.items() if v)
+        detailed_description = (
+            f"Generate a melody for the instrument '{melody_instrument.name}'. "
+            f"{description}. Parameters: {parameters}"
+            f". The duration should be approximately {duration_bars} bars ({duration_beats} beats)."
+            f". Adhere strictly to the key ({key} {mode}) and follow the chord progression ({chord_progression}) closely."
         )
-        detailed_description += f". The duration should be approximately {duration_bars} bars ({duration_beats} beats)."
-        detailed_description += f". Adhere strictly to the key ({key} {mode}) and follow the chord progression ({chord_progression}) closely."
 
         logger.info(
-            f"Requesting melody generation with description: {detailed_description[:150]}..."
+            "Requesting melody generation with description: %.150s...",
+            detailed_description,
         )
 
         try:
             allowed_intervals_string = ", ".join(map(str, allowed_intervals))
+            chord_names = chord_progression.split("-")
+
+            try:
+                note_probabilities_string = _get_note_probabilities_json(
+                    chord_progression, key
+                )
+            except Exception as analysis_err:
+                logger.error(
+                    "Failed to analyze chord progression for note probabilities: %s",
+                    analysis_err,
+                    exc_info=True,
+                )
+                note_probabilities_string = "{}"
 
-            system_prompt = get_melody_create_prompt(
+            # Identical for every segment, so the opening segment's request caches it
+            # for the rest; what differs per segment goes in the message
+            melody_prompt = get_melody_create_prompt(
                 key,
                 mode,
                 tempo,
@@ -833,80 +1213,149 @@ Then, use the create_melody tool to generate the notes."""
                 melodic_character,
                 duration_bars,
                 duration_beats,
+                output_tool=WRITE_MELODY_NOTES_TOOL["name"],
             )
-            self.melody_composer.set_system_prompt(system_prompt)
-
-            try:
-                chord_progression_list = re.split(r"[-,\s]+", chord_progression)
-                chord_progression_list = [
-                    chord.strip().replace("b", "-")
-                    for chord in chord_progression_list
-                    if chord.strip()
-                ]
-                note_probabilities = analyze_chord_progression(
-                    chord_progression_list, key
-                )
-                note_probabilities_string = json.dumps(note_probabilities, indent=2)
-                logger.debug(
-                    f"Note probabilities calculated for chords: {chord_progression_list}"
+            system_prompt = f"""{melody_prompt}
+Use this note probability data derived from the chord progression to guide note selection:
+{note_probabilities_string}"""
+
+            async def compose_segment(
+                start_bar: int, bars: int, opening: Optional[Dict[str, Any]]
+            ) -> Dict[str, Any]:
+                """
+                Writes `bars` bars of the melody, starting at bar `start_bar`. Later
+                segments get the `opening` segment to carry on its rhythm and motif.
+                """
+                # One chord per bar, looping the progression if the melody is longer
+                segment_chords = "-".join(
+                    chord_names[(start_bar + i) % len(chord_names)]
+                    for i in range(bars)
                 )
-            except Exception as analysis_err:
-                logger.error(
-                    f"Failed to analyze chord progression for note probabilities: {analysis_err}",
-                    exc_info=True,
-                )
-                note_probabilities_string = "{}"
+                if opening is None:
+                    continuation = "Start on the root note. The rest of the melody repeats the rhythm and motif of these bars, so make them worth repeating."
+                else:
+                    continuation = f"""Bars 1-{MELODY_SEGMENT_BARS} are already written: {json.dumps(opening.get("bars", []))}
+Repeat their rhythm and develop their motif so the whole melody sounds like one loop. Your first interval is measured from the last note of those bars, not from the root."""
 
-            message = f"""Create the musical notes for a melody based on the following:
+                message = f"""Create the musical notes for a melody based on the following:
 Description: {detailed_description}
-Use this note probability data derived from the chord progression to guide note selection: 
-{note_probabilities_string}
+You are writing bars {start_bar + 1}-{start_bar + bars} of the {duration_bars}-bar melody, over the chords {segment_chords}; write exactly {bars} bars.
+{continuation}
 
 Constraints:
 - Adhere strictly to the key of {key} {mode}.
 - Make the rhythm of the melody match the rhythm type '{rhythm_type}'.
 - The rhythm should always be repetitive and something that can be played in a loop. The rhythm MUST be repeated 2, 4, 8, 16, 32, or more times. The rhythm should be as repetitive as possible. DO NOT create a melody with a rhythm that is not repeated. DO NOT create a melody that has a sporadic rhythm.
-- Follow the chord progression '{chord_progression}' closely.
-- The output MUST be ONLY a valid JSON object representing the melody structure (e.g., bars, notes with pitch, start_beat, duration_beats).
-- Do NOT include any explanatory text, comments, or markdown formatting before or after the JSON object.
+- Follow the chords '{segment_chords}' closely.
 
-Example JSON structure (adapt as needed for your expected format):
-{{
-  "bars": [
-    {{ "bar": 1, "notes": [{{"pitch": 60, "start_beat": 0, "duration_beats": 1}}, ...] }},
-    {{ "bar": 2, "notes": [...] }}
-  ]
-}}
+Write the melody now."""
 
-Generate the JSON output now."""
+                # One request per conversation; only the shared system prompt is cached
+                composer = AnthropicClient(
+                    system_prompt=system_prompt, cache_history=False
+                )
+                # Only the first segment streams to the client so the chunks don't interleave.
+                # Extended thinking only allows an automatic tool_choice.
+                content_text, tool_use_json = await composer.send_message_async(
+                    message,
+                    queue if start_bar == 0 else None,
+                    stream=True,
+                    tools=[WRITE_MELODY_NOTES_TOOL],
+                    thinking=True,
+                    tool_choice=_AUTO_TOOL_CHOICE,
+                )
+                if tool_use_json:
+                    return tool_use_json
+
+                logger.debug(
+                    "Raw melody LLM response for bar %s (first 500 chars): %.500s",
+                    start_bar + 1,
+                    content_text,
+                )
+
+                # The model answered in text instead; fall back to parsing the reply
+                melody_data = self._extract_json_from_text(content_text)
+                if not melody_data:
+                    logger.error(
+                        "Failed to extract valid JSON melody data from the LLM response."
+                    )
+                    raise ValueError(
+                        "LLM response did not contain valid JSON for melody."
+                    )
+                return melody_data
+
+            async def try_compose_segment(
+                start_bar: int, bars: int, opening: Optional[Dict[str, Any]]
+            ) -> Optional[Dict[str, Any]]:
+                """compose_segment, retried on failure; None if every attempt fails."""
+                for attempt in range(1, _MELODY_SEGMENT_ATTEMPTS + 1):
+                    try:
+                        return await compose_segment(start_bar, bars, opening)
+                    except Exception as e:
+                        logger.warning(
+                            "Melody bars %s-%s failed (attempt %s): %s",
+                            start_bar + 1,
+                            start_bar + bars,
+                            attempt,
+                            e,
+                        )
+                return None
 
             await queue.stage(
                 "Generating melody notes...",
                 "Asking the AI composer to write the melody...",
             )
-            content_text, _ = await self.melody_composer.send_message_async(
-                message, queue, stream=True, thinking=True
-            )
-
-            logger.debug(
-                f"Raw melody LLM response (first 500 chars): {content_text[:500]}"
-            )
-
-            melody_data = self._extract_json_from_text(content_text)
-            if not melody_data:
-                logger.error(
-                    "Failed to extract valid JSON melody data from the LLM response."
-                )
-                raise ValueError("LLM response did not contain valid JSON for melody.")
+            # Output decoding dominates melody latency, so the bars are written by
+            # requests of MELODY_SEGMENT_BARS each and joined afterwards. The opening
+            # segment is written first and the others concurrently from it, so they
+            # share its rhythm and motif (and read the system prompt it cached).
+            # A segment that keeps failing is left silent; the others are kept.
+            segment_bounds = [
+                (start_bar, min(MELODY_SEGMENT_BARS, duration_bars - start_bar))
+                for start_bar in range(0, duration_bars, MELODY_SEGMENT_BARS)
+            ]
+            opening = await try_compose_segment(*segment_bounds[0], None)
+            segments = [
+                opening,
+                *await asyncio.gather(
+                    *(
+                        try_compose_segment(start_bar, bars, opening)
+                        for start_bar, bars in segment_bounds[1:]
+                    )
+                ),
+            ]
+            if not any(segments):
+                raise ValueError("Every melody segment failed.")
 
             logger.info("Successfully parsed melody JSON data.")
-            logger.debug(
-                f"Parsed Melody Data (snippet): {json.dumps(melody_data)[:200]}..."
-            )
+            # Serializing the whole melody just for a snippet is only worth it when debugging
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(
+                    "Parsed Melody Data (snippet): %.200s...", json.dumps(segments)
+                )
 
-            result = transform_bars_to_instrument_format(
-                melody_data, melody_instrument, key
-            )
+            # Each segment is rendered on its own and shifted to its bar position.
+            # Later segments continue from the opening's last note, as they were told.
+            result = None
+            continuation_pitch = None
+            for (start_bar, bars), melody_data in zip(segment_bounds, segments):
+                if melody_data is None:
+                    continue
+                segment_result = transform_bars_to_instrument_format(
+                    melody_data,
+                    melody_instrument,
+                    key,
+                    start_pitch=continuation_pitch if start_bar else None,
+                )
+                notes = segment_result["notes"]["notes"]
+                if start_bar == 0 and notes:
+                    continuation_pitch = notes[-1]["pitch"]
+                segment_notes = _place_segment_notes(notes, start_bar, bars)
+                if result is None:
+                    segment_result["notes"]["notes"] = segment_notes
+                    result = segment_result
+                else:
+                    result["notes"]["notes"].extend(segment_notes)
 
             if not result or "notes" not in result or not result["notes"]:
                 logger.error("Melody transformation returned empty or invalid result.")
@@ -941,12 +1390,12 @@ Generate the JSON output now."""
                 )
             )
 
-            logger.info(f"Generated melody with {len(result.get('notes', []))} notes.")
+            logger.info("Generated melody with %s notes.", len(result.get("notes", [])))
             return result
 
         except Exception as e:
-            logger.error(f"Error during melody generation: {str(e)}")
-            logger.error(f"Stack trace: {traceback.format_exc()}")
+            logger.error("Error during melody generation: %s", e)
+            logger.error("Stack trace: %s", traceback.format_exc())
             return None
 
     def _extract_json_from_text(self, text: str) -> Optional[Dict[str, Any]]:
@@ -954,58 +1403,57 @@ Generate the JSON output now."""
         Attempts to extract a JSON object from a string.
         Handles markdown code blocks and raw JSON.
         """
-        logger.debug(f"Attempting to extract JSON from text (length {len(text)})...")
+        logger.debug("Attempting to extract JSON from text (length %s)...", len(text))
 
-        json_match = re.search(
-            r"```(?:json)?\s*({.*?})\s*```", text, re.DOTALL | re.IGNORECASE
-        )
-        if json_match:
-            json_content = json_match.group(1)
-            logger.debug("Found JSON within markdown code block.")
+        # Common case: the reply is nothing but the JSON object
+        trimmed_text = text.strip()
+        if trimmed_text[:1] == "{":
             try:
-                json_content = json_content.strip()
-                parsed_json = json.loads(json_content)
-                logger.info("Successfully parsed JSON from markdown block.")
+                return json.loads(trimmed_text)
+            except json.JSONDecodeError:
+                pass
+
+        parsed_json = self._decode_outer_json_object(text)
+        if parsed_json is not None:
+            logger.info("Successfully parsed JSON object from text.")
+            return parsed_json
+
+        # Only pay for comment stripping when the object didn't parse as written
+        stripped_text = _JSON_COMMENT_RE.sub("", text)
+        if stripped_text != text:
+            logger.debug("Retrying JSON extraction with comments stripped.")
+            parsed_json = self._decode_outer_json_object(stripped_text)
+            if parsed_json is not None:
+                logger.info("Successfully parsed JSON after stripping comments.")
                 return parsed_json
-            except json.JSONDecodeError as e:
-                logger.warning(
-                    f"Failed to parse JSON from markdown block: {e}. Content: {json_content[:100]}..."
-                )
-                # Fall through to other methods
 
-        first_brace = text.find("{")
-        last_brace = text.rfind("}")
-        if first_brace != -1 and last_brace != -1 and last_brace > first_brace:
-            potential_json = text[first_brace : last_brace + 1]
-            logger.debug("Attempting to parse content between first/last braces.")
-            try:
-                parsed_json = json.loads(potential_json)
-                logger.info("Successfully parsed JSON between first/last braces.")
-                return parsed_json
-            except json.JSONDecodeError as e:
-                logger.warning(
-                    f"Failed to parse JSON between first/last braces: {e}. Content: {potential_json[:100]}..."
-                )
-                # Fall through
+        logger.error("Could not find or parse valid JSON in the provided text.")
+        return None
 
-        json_regex_match = re.search(r"({[\s\S]*})", text)
-        if json_regex_match:
-            potential_json = json_regex_match.group(1)
-            logger.debug("Attempting to parse JSON found via greedy regex.")
+    @staticmethod
+    def _decode_outer_json_object(text: str) -> Optional[Dict[str, Any]]:
+        """
+        Returns the outermost JSON object in the text, or None: the one opening the first
+        markdown code block if there is one, otherwise the first one in the text.
+        Only these starts are decoded (raw_decode stops at the end of the object, so
+        surrounding prose needs no trimming); an object nested inside one that failed to
+        parse is never returned in its place.
+        """
+        starts = []
+        fence_start = text.find("```")
+        if fence_start != -1:
+            starts.append(text.find("{", fence_start))
+        starts.append(text.find("{"))
+
+        for start in starts:
+            if start == -1:
+                continue
             try:
-                potential_json = re.sub(
-                    r"//.*?\n|/\*.*?\*/", "", potential_json, flags=re.DOTALL
-                )
-                parsed_json = json.loads(potential_json)
-                logger.info("Successfully parsed JSON via greedy regex.")
+                parsed_json, _ = _JSON_DECODER.raw_decode(text, start)
+            except json.JSONDecodeError:
+                continue
+            if isinstance(parsed_json, dict):
                 return parsed_json
-            except json.JSONDecodeError as e:
-                logger.warning(
-                    f"Failed to parse JSON from greedy regex match: {e}. Content: {potential_json[:100]}..."
-                )
-                # Fall through
-
-        logger.error("Could not find or parse valid JSON in the provided text.")
         return None
 
     def _set_musical_params(
@@ -1018,73 +1466,54 @@ Generate the JSON output now."""
         chords_instrument_suggestion,
     ):
         """Sets the core musical parameters."""
-        self.musical_params.key = key or "C"
-        self.musical_params.mode = mode or "major"
-        self.musical_params.chord_progression = chord_progression or "I-V-vi-IV"
-        try:
-            self.musical_params.bpm = int(bpm) if bpm else 120
-        except (ValueError, TypeError):
-            logger.warning(f"Invalid BPM value received: {bpm}. Defaulting to 120.")
-            self.musical_params.bpm = 120
-
-        try:
-            self.musical_params.allowed_intervals = get_mode_intervals(
-                self.musical_params.mode
-            )
-        except ValueError as e:
-            logger.warning(
-                f"Could not determine intervals for mode '{self.musical_params.mode}': {e}. Using major scale intervals."
-            )
-            self.musical_params.allowed_intervals = get_mode_intervals("major")
-
-        self.musical_params.melody_instrument_suggestion = melody_instrument_suggestion
-        self.musical_params.chords_instrument_suggestion = chords_instrument_suggestion
-
-        self.musical_params.melody = None
-        self.musical_params.chords = None
-        self.musical_params.counter_melody = None
+        mode = mode or "major"
+        # Stored dash-separated once so every consumer (and the analysis cache) sees one form
+        if isinstance(chord_progression, list):
+            chord_progression = "-".join(map(str, chord_progression))
+        chord_progression = (
+            "-".join(c for c in _CHORD_SEPARATOR_RE.split(chord_progression) if c)
+            if isinstance(chord_progression, str)
+            else ""
+        )
+        # The tool schema asks for an integer; whole floats and numeric strings are
+        # accepted too
+        parsed_bpm = _parse_positive_int(bpm)
+        if parsed_bpm is None:
+            if bpm:
+                logger.warning(
+                    "Invalid BPM value received: %s. Defaulting to 120.", bpm
+                )
+            parsed_bpm = 120
+
+        # One new params object instead of a series of attribute writes on the old one
+        self.musical_params = replace(
+            self.musical_params,
+            key=key or "C",
+            mode=mode,
+            chord_progression=chord_progression or "I-V-vi-IV",
+            bpm=parsed_bpm,
+            allowed_intervals=list(_get_mode_intervals(mode)),
+            melody_instrument_suggestion=melody_instrument_suggestion,
+            chords_instrument_suggestion=chords_instrument_suggestion,
+            melody=None,
+            chords=None,
+            counter_melody=None,
+        )
 
-        self.selected_instruments = []
+        self._clear_selected_instruments()
 
-    @staticmethod
-    def _get_stream_response(response) -> tuple[str, dict]:
-        content_text = ""
-        tool_use_started = False
-        tool_use_data = []
-        for data in response:
-            if tool_use_started:
-                tool_use_data.append(data)
-            if hasattr(data, "delta") and hasattr(data.delta, "text"):
-                chunk_text = data.delta.text
-                print(chunk_text)
-                if chunk_text:
-                    content_text += chunk_text
-                    logger.info(f"Received {len(content_text)} characters so far...")
-            if data.type == "content_block_start":
-                if data.content_block.type == "tool_use":
-                    tool_use_started = True
-                    print(data.content_block)
-            if data.type == "content_block_end":
-                tool_use_started = False
-        print("TOOL USE DATA:", tool_use_data)
-        tool_use_json = MusicGenService._parse_tool_use_data(tool_use_data)
-        print("TOOL USE JSON:", tool_use_json)
-        return content_text, tool_use_json
 
-    @staticmethod
-    def _parse_tool_use_data(tool_use_data) -> dict:
-        full_json = ""
-        for data in tool_use_data:
-            if hasattr(data, "delta") and hasattr(data.delta, "partial_json"):
-                full_json += data.delta.partial_json
+class MusicGenService:
+    def __init__(self):
+        # Shared by every composition, along with its research cache
+        self.researcher = MusicResearcher()
 
-        try:
-            if full_json:
-                return json.loads(full_json)
-            return None
-        except json.JSONDecodeError as e:
-            logger.error(f"Failed to parse tool use JSON: {e}")
-            return None
+    async def compose_music(
+        self, prompt: str, queue: SSEQueueManager, session: Session
+    ) -> Dict[str, Any]:
+        # The service is a module-level singleton, so each call composes on its own
+        # conversations and state instead of the instance's
+        return await MusicComposition(self.researcher).compose(prompt, queue, session)
 
 
 music_gen_service = MusicGenService()
@@ -175,3 +175,87 @@ CREATE_DRUM_BEAT_TOOL = {
         "required": ["drum_beats"],
     },
 }
+
+CREATE_DRUM_PATTERN_TOOL = {
+    "name": "create_drum_pattern",
+    "description": "Creates the drum pattern for one drum sound. The pattern is a string of 32 steps representing 16th notes over 2 bars (4/4 time).",
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "pattern": {
+                "type": "string",
+                "description": "Exactly 32 steps, one per 16th note: 'x' means the drum hits on that 16th note, '.' means silence ('X' and '-' are read the same way). '|' and spaces may separate beats or bars and are ignored. This covers 2 bars (e.g. 'x...x...x...x...x...x...x...x...').",
+                # 32 hit or rest steps, with optional separators anywhere
+                "pattern": "^[| ]*(?:[xX.-][| ]*){32}$",
+            },
+        },
+        "required": ["pattern"],
+    },
+}
+
+WRITE_MELODY_NOTES_TOOL = {
+    "name": "write_melody_notes",
+    "description": "Writes the notes of the melody as relative semitone intervals. Call this once, after planning the melody, with every bar you were asked to write.",
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "starting_octave": {
+                "type": "integer",
+                "description": "The octave to start on (3-5)",
+            },
+            "bars": {
+                "type": "array",
+                "description": "The bars of the melody, in order",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "bar_number": {
+                            "type": "integer",
+                            "description": "The bar number of this bar of the melody, starting at 1",
+                        },
+                        "musical_intention": {
+                            "type": "string",
+                            "description": "The musical intention for this bar of the melody",
+                        },
+                        "notes": {
+                            "type": "array",
+                            "items": {
+                                "type": "object",
+                                "properties": {
+                                    "interval": {
+                                        "type": "string",
+                                        "description": "Semitones from the previous note (or the root for the first note), e.g. '0', '+2', '-3', or 'R' for a rest",
+                                    },
+                                    "duration": {
+                                        "type": "string",
+                                        "description": "Note duration, e.g. 'sixteenth', 'eighth', 'quarter', 'dotted quarter', 'eighth triplet', 'half'",
+                                    },
+                                    "velocity": {
+                                        "type": "integer",
+                                        "description": "Note velocity (1-127)",
+                                    },
+                                    "cumulative_sum": {
+                                        "type": "integer",
+                                        "description": "Cumulative sum of the intervals so far (between -7 and +7)",
+                                    },
+                                    "is_in_key": {
+                                        "type": "boolean",
+                                        "description": "Whether the cumulative sum is one of the allowed in-key intervals",
+                                    },
+                                },
+                                "required": ["interval", "duration", "velocity"],
+                            },
+                        },
+                    },
+                    "required": ["bar_number", "notes"],
+                },
+            },
+        },
+        "required": ["bars"],
+    },
+}
+
+# Tools of the parameter conversation, which calls both in one response. The same list
+# is sent on its follow-up turns (the turn's tool is chosen through tool_choice) so the
+# tools block stays identical and the prompt cache prefix is reused across turns.
+PARAMETER_TOOLS = [DETERMINE_MUSICAL_PARAMETERS_TOOL, SELECT_INSTRUMENTS_TOOL]
@@ -4,7 +4,9 @@ Uses OpenAI client library to connect to Perplexity's API.
 """
 
 import logging
-from typing import Dict, Any, Optional
+from collections import OrderedDict
+import time
+from typing import Awaitable, Callable, Dict, Any, Optional, Tuple
 from dotenv import load_dotenv
 import asyncio
 
@@ -36,6 +38,11 @@ print("[RESEARCH MODULE] MusicResearcher module initialized, stdout handler adde
 logger.info("MusicResearcher module initialized with custom handler")
 load_dotenv()
 
+# Research on a style doesn't change between requests, so repeated descriptions reuse
+# it for this long; the oldest entries are dropped past RESEARCH_CACHE_SIZE
+RESEARCH_CACHE_TTL_SECONDS = 3600
+RESEARCH_CACHE_SIZE = 256
+
 
 class MusicResearcher:
     """
@@ -50,6 +57,36 @@ class MusicResearcher:
             api_key: Perplexity API key. If not provided, uses PERPLEXITY_API_KEY env variable.
         """
         self.perplexity_client = PerplexityClient()
+        # (research kind, normalized description) -> (time stored, research)
+        self._research_cache: OrderedDict[Tuple[str, str], Tuple[float, str]] = (
+            OrderedDict()
+        )
+
+    async def _cached_research(
+        self,
+        kind: str,
+        description: str,
+        research: Callable[[str], Awaitable[Optional[str]]],
+    ) -> Optional[str]:
+        """
+        Returns the cached `kind` research for the description, running `research` on a miss.
+        Descriptions differing only in case or whitespace share an entry; failed or
+        empty research is not cached.
+        """
+        key = (kind, " ".join(description.split()).casefold())
+        cached = self._research_cache.get(key)
+        if cached and time.monotonic() - cached[0] < RESEARCH_CACHE_TTL_SECONDS:
+            self._research_cache.move_to_end(key)
+            logger.debug(f"Using cached {kind} research")
+            return cached[1]
+
+        result = await research(description)
+        if result:
+            self._research_cache[key] = (time.monotonic(), result)
+            self._research_cache.move_to_end(key)
+            if len(self._research_cache) > RESEARCH_CACHE_SIZE:
+                self._research_cache.popitem(last=False)
+        return result
 
     async def enhance_description(self, description: str) -> Dict[str, Any]:
         """
@@ -69,7 +106,9 @@ class MusicResearcher:
                 f"[DIRECT PRINT] Researching musical context for: {description[:40]}..."
             )
             logger.info(f"Researching musical context for: {description[:40]}...")
-            research_content = await self._research_music(description)
+            research_content = await self._cached_research(
+                "music", description, self._research_music
+            )
 
             logger.info(f"Research complete, got {len(research_content)} chars")
 
@@ -91,12 +130,16 @@ class MusicResearcher:
         print(
             f"[DIRECT PRINT] Beginning research_chord_progression for: {description[:50]}..."
         )
-        return await self._research_chord_progression(description)
+        return await self._cached_research(
+            "chord_progression", description, self._research_chord_progression
+        )
 
     async def research_drum_sounds(self, description: str) -> str:
         """Research drum sounds using Perplexity."""
         logger.debug(f"Beginning research_drum_sounds for: {description[:50]}...")
-        return await self._research_drum_sounds(description)
+        return await self._cached_research(
+            "drum_sounds", description, self._research_drum_sounds
+        )
 
     async def _research_music(self, description: str) -> str:
         """Research musical characteristics using Perplexity."""
@@ -1,3 +1,6 @@
+from functools import lru_cache
+
+
 def get_ai_composer_agent_initial_system_prompt() -> str:
     return """You are the leader of a group of AI agents who are going to compose a beat or song together. You are the customer facing agent.
 You will be using tools to call other agents for things like generating melodies, chords, drums, etc. with various descriptions, and those tools will be used to call
@@ -26,6 +29,8 @@ The chord progression you create needs to be {duration_bars} bars long and needs
 """
 
 
+# Melody segments of a composition (and repeat compositions) build identical prompts
+@lru_cache(maxsize=128)
 def get_melody_create_prompt(
     key: str,
     mode: str,
@@ -39,12 +44,21 @@ def get_melody_create_prompt(
     melodic_character: str,
     duration_bars: int,
     duration_beats: int,
+    output_tool: str = "",
 ) -> str:
+    # With output_tool the melody is returned through that tool instead of as JSON in
+    # the reply; the fields it takes are the same
+    if output_tool:
+        output_instruction = f"IMPORTANT: Return the melody by calling the {output_tool} tool, not as JSON in your response."
+        output_fields = f"Call the {output_tool} tool with:"
+    else:
+        output_instruction = "IMPORTANT: Make sure the end of your response is the JSON object WITH THE JSON TAG."
+        output_fields = "Respond at the end of your response with a JSON object containing (IMPORTANT: MAKE SURE YOU INCLUDE THE JSON TAG):"
     return f"""You are a music composer creating a melodic pattern based on a text description.
 The melody you create needs to be {duration_bars} bars long and needs to be in the key of {key} {mode} at {tempo} BPM.
 
 Your task is to create a melody using INTERVALS (semitones) from the LAST NOTE (not the root note) rather than absolute pitches. Try to make the melody as catchy as possible by following repeated rhythmic patterns. This melody will be played in a loop, so it should sound good when played repeatedly. It is crucial to follow a structured rhythmic pattern for this reason. Try to follow a similar rhythmic pattern in each bar or pair of bars.
-You will structure your output into {duration_bars} bars, each with their own musical intention. IMPORTANT: Make sure the end of your response is the JSON object WITH THE JSON TAG.
+You will structure your output into {duration_bars} bars, each with their own musical intention. {output_instruction}
 
 Musical Considerations:
 - Mood: {mood if mood else "Not specified"}
@@ -118,7 +132,7 @@ IMPORTANT:
 - You must choose notes that follow the chord progression: {chord_progression} as closely as possible.
 - You must use a repetitive rhythmic pattern.
 
-Respond at the end of your response with a JSON object containing (IMPORTANT: MAKE SURE YOU INCLUDE THE JSON TAG):
+{output_fields}
 - "starting_octave": The octave to start on (3-5)
 - "bars": Array of dicts with keys "bar_number", "notes"
     - "bar_number": The bar number associated with this bar of the melody (1-{duration_bars})
@@ -0,0 +1,73 @@
+from types import SimpleNamespace
+
+import pytest
+import pytest_asyncio
+
+
+class EmptyStream:
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        raise StopAsyncIteration
+
+
+@pytest_asyncio.fixture
+async def anthropic_client():
+    """
+    clients.anthropic_client, imported inside the running loop (the request manager
+    singleton starts its cleanup task at import time).
+    """
+    from clients import anthropic_client
+
+    return anthropic_client
+
+
+@pytest.fixture
+def requests_sent():
+    """API client recording the parameters of every messages.create call."""
+    sent = []
+
+    async def create(**params):
+        sent.append(params)
+        return EmptyStream()
+
+    return sent, SimpleNamespace(messages=SimpleNamespace(create=create))
+
+
+class TestCacheBreakpoints:
+    TOOLS = [{"name": "first"}, {"name": "second"}]
+
+    async def _send(self, anthropic_client, requests_sent, **kwargs):
+        sent, api = requests_sent
+        client = anthropic_client.AnthropicClient(
+            system_prompt="system", async_client=api, **kwargs
+        )
+        await client.send_message_async("hello", None, tools=self.TOOLS)
+        return sent[-1]
+
+    async def test_cached_by_default(self, anthropic_client, requests_sent):
+        params = await self._send(anthropic_client, requests_sent)
+
+        cache_control = anthropic_client.CACHE_CONTROL
+        assert params["system"][0]["cache_control"] == cache_control
+        assert params["messages"][-1]["content"][0]["cache_control"] == cache_control
+        assert params["tools"][-1]["cache_control"] == cache_control
+
+    async def test_one_shot_keeps_only_the_system_breakpoint(
+        self, anthropic_client, requests_sent
+    ):
+        params = await self._send(anthropic_client, requests_sent, cache_history=False)
+
+        assert "cache_control" in params["system"][0]
+        assert params["messages"] == [{"role": "user", "content": "hello"}]
+        assert params["tools"] == self.TOOLS
+
+    async def test_no_breakpoints(self, anthropic_client, requests_sent):
+        params = await self._send(
+            anthropic_client, requests_sent, cache_system=False, cache_history=False
+        )
+
+        assert params["system"] == "system"
+        assert params["messages"] == [{"role": "user", "content": "hello"}]
+        assert params["tools"] == self.TOOLS
@@ -0,0 +1,84 @@
+from types import SimpleNamespace
+
+import pytest
+import pytest_asyncio
+
+
+@pytest_asyncio.fixture
+async def midi():
+    """midi.py, imported inside the running loop like the rest of the service."""
+    # music_agent first: it and midi.py import each other
+    import app2.llm.agents.music_agent  # noqa: F401
+    from app2.llm.music_gen_service import midi
+
+    return midi
+
+
+@pytest.fixture
+def instrument():
+    return SimpleNamespace(
+        id="instrument-id", storage_key="soundfonts/piano.sf2", display_name="Piano"
+    )
+
+
+def _assert_integer_ticks(notes):
+    assert notes
+    for note in notes:
+        assert type(note["start"]) is int
+        assert type(note["duration"]) is int
+
+
+class TestTransformBars:
+    def test_ticks_are_integers(self, midi, instrument):
+        data = {
+            "bars": [
+                {
+                    "notes": [
+                        {"interval": "0", "duration": "eighth triplet"},
+                        {"interval": "+2", "duration": "dotted quarter"},
+                        {"interval": "R", "duration": "sixteenth"},
+                        {"interval": "-2", "duration": 1.5},
+                    ]
+                }
+            ]
+        }
+        notes = midi.transform_bars_to_instrument_format(data, instrument, "C")[
+            "notes"
+        ]["notes"]
+
+        _assert_integer_ticks(notes)
+        assert len(notes) == 3
+
+    def test_malformed_duration_defaults_to_quarter(self, midi, instrument):
+        data = {"bars": [{"notes": [{"interval": "0", "duration": ["half"]}]}]}
+        notes = midi.transform_bars_to_instrument_format(data, instrument, "C")[
+            "notes"
+        ]["notes"]
+
+        assert notes[0]["duration"] == midi.settings.audio.PPQ
+
+
+class TestTransformChordProgression:
+    def test_ticks_are_integers(self, midi, instrument):
+        notes = midi.transform_chord_progression_to_instrument_format(
+            "C-G-Am-F", instrument, "C"
+        )["notes"]["notes"]
+
+        _assert_integer_ticks(notes)
+        assert {n["start"] for n in notes} == {
+            i * 4 * midi.settings.audio.PPQ for i in range(4)
+        }
+
+
+class TestConvertDurationToBeats:
+    @pytest.mark.parametrize(
+        "duration, beats",
+        [("quarter", 1.0), ("Half", 2.0), ("quarter.", 1.5), ("0.5", 0.5), (3, 3.0)],
+    )
+    def test_valid(self, midi, duration, beats):
+        assert midi._convert_duration_to_beats(duration) == beats
+
+    @pytest.mark.parametrize("duration", [["quarter"], {"beats": 1}, None, "long"])
+    def test_invalid_raises_value_error(self, midi, duration):
+        with pytest.raises(ValueError):
+            midi._convert_duration_to_beats(duration)
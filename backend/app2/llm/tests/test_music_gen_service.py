@@ -0,0 +1,476 @@
+import re
+import uuid
+from types import SimpleNamespace
+
+import pytest
+import pytest_asyncio
+
+
+@pytest_asyncio.fixture
+async def mgs():
+    """
+    The music_gen_service module, imported inside the running loop (the request
+    manager singleton starts its cleanup task at import time).
+    """
+    # music_agent first: it and midi.py import each other
+    import app2.llm.agents.music_agent  # noqa: F401
+    from app2.llm.music_gen_service import music_gen_service
+
+    return music_gen_service
+
+
+@pytest_asyncio.fixture
+async def service(mgs):
+    return mgs.MusicComposition(mgs.MusicResearcher())
+
+
+class FakeQueue:
+    """Records the actions sent to the client; stage updates are ignored."""
+
+    def __init__(self):
+        self.actions = []
+
+    async def stage(self, *args, **kwargs):
+        pass
+
+    async def action(self, action):
+        self.actions.append(action)
+
+    async def error(self, message):
+        pass
+
+
+def _segment(*notes):
+    """write_melody_notes input with one bar per (interval, duration) note."""
+    return {
+        "bars": [
+            {
+                "bar_number": i + 1,
+                "notes": [{"interval": interval, "duration": duration, "velocity": 80}],
+            }
+            for i, (interval, duration) in enumerate(notes)
+        ]
+    }
+
+
+class TestComposeMusic:
+    async def test_each_call_composes_on_its_own_state(self, mgs, monkeypatch):
+        compositions = []
+
+        async def compose(composition, prompt, queue, session):
+            compositions.append(composition)
+            return {}
+
+        monkeypatch.setattr(mgs.MusicComposition, "compose", compose)
+        service = mgs.MusicGenService()
+
+        await service.compose_music("lofi", FakeQueue(), None)
+        await service.compose_music("trap", FakeQueue(), None)
+
+        first, second = compositions
+        assert first is not second
+        assert first.drum_composer is not second.drum_composer
+        assert first.musical_params is not second.musical_params
+        assert first.researcher is second.researcher is service.researcher
+
+
+class TestExtractJsonFromText:
+    def test_plain_json(self, service):
+        assert service._extract_json_from_text(' {"a": 1}\n') == {"a": 1}
+
+    def test_leading_object_with_trailing_prose(self, service):
+        # Fails the whole-reply parse and falls through to the scan
+        assert service._extract_json_from_text('{"a": 1} Enjoy!') == {"a": 1}
+
+    def test_fenced(self, service):
+        text = 'Here it is:\n```json\n{"bars": [{"bar": 1}]}\n```\nDone.'
+        assert service._extract_json_from_text(text) == {"bars": [{"bar": 1}]}
+
+    def test_prose_wrapped(self, service):
+        text = 'The melody is {"a": 1} as requested.'
+        assert service._extract_json_from_text(text) == {"a": 1}
+
+    def test_fence_preferred_over_stray_braces(self, service):
+        text = 'Use {bad} notes.\n```json\n{"a": 1}\n```'
+        assert service._extract_json_from_text(text) == {"a": 1}
+
+    def test_line_comment_keeps_outer_object(self, service):
+        text = '```json\n{"bars": [ // first bar\n {"bar": 1}]}\n```'
+        assert service._extract_json_from_text(text) == {"bars": [{"bar": 1}]}
+
+    def test_block_comment(self, service):
+        text = '{"a": /* tonic */ 1}'
+        assert service._extract_json_from_text(text) == {"a": 1}
+
+    def test_comment_markers_in_strings_survive(self, service):
+        # Comments are only stripped when the reply doesn't parse as written
+        text = 'Sample: {"url": "https://example.com/a.wav"} for the melody.'
+        assert service._extract_json_from_text(text) == {
+            "url": "https://example.com/a.wav"
+        }
+
+    def test_no_json(self, service):
+        assert service._extract_json_from_text("no melody here") is None
+
+
+class TestDrumSampleCache:
+    @pytest.fixture
+    def drum_samples(self, mgs, monkeypatch):
+        """Drum sample service counting its calls, behind an emptied module cache."""
+        monkeypatch.setattr(mgs, "_drum_sample_cache", None)
+
+        class FakeDrumSampleService:
+            samples = [
+                SimpleNamespace(id=uuid.uuid4(), display_name=name)
+                for name in ("Kick", "Snare")
+            ]
+            calls = 0
+
+            async def get_all_samples(self):
+                self.calls += 1
+                return self.samples
+
+        return FakeDrumSampleService()
+
+    async def test_names_and_map(self, mgs, drum_samples):
+        samples, names, by_name = await mgs._get_drum_samples_cached(drum_samples)
+
+        assert samples == drum_samples.samples
+        assert names == ["Kick", "Snare"]
+        assert by_name["Snare"] is drum_samples.samples[1]
+
+    async def test_reused_within_the_ttl(self, mgs, drum_samples):
+        first = await mgs._get_drum_samples_cached(drum_samples)
+        second = await mgs._get_drum_samples_cached(drum_samples)
+
+        assert second is first
+        assert drum_samples.calls == 1
+
+    async def test_empty_catalogue_is_not_cached(self, mgs, drum_samples):
+        drum_samples.samples = []
+
+        await mgs._get_drum_samples_cached(drum_samples)
+        await mgs._get_drum_samples_cached(drum_samples)
+
+        assert drum_samples.calls == 2
+
+
+class TestSetMusicalParams:
+    @pytest.mark.parametrize(
+        "bpm, expected",
+        [
+            (95, 95),
+            (95.0, 95),
+            ("95", 95),
+            (" 95 ", 95),
+            (95.5, 120),
+            (True, 120),
+            ("-5", 120),
+            ("abc", 120),
+            (0, 120),
+            (None, 120),
+        ],
+    )
+    def test_bpm(self, service, bpm, expected):
+        service._set_musical_params("C", "major", "C-G", bpm, "", "")
+        assert service.musical_params.bpm == expected
+
+    @pytest.mark.parametrize(
+        "chord_progression, expected",
+        [
+            ("C-G-Am-F", "C-G-Am-F"),
+            ("C G, Am  F", "C-G-Am-F"),
+            (["C", "G", "Am", "F"], "C-G-Am-F"),
+            ("", "I-V-vi-IV"),
+            (None, "I-V-vi-IV"),
+        ],
+    )
+    def test_chord_progression(self, service, chord_progression, expected):
+        service._set_musical_params("C", "major", chord_progression, 120, "", "")
+        assert service.musical_params.chord_progression == expected
+
+
+class TestAddSelectedInstrument:
+    def test_first_instrument_per_role_is_indexed(self, service):
+        for name, role in [
+            ("Piano", "melody"),
+            ("Violin", "melody"),
+            ("Piano", "chords"),
+        ]:
+            soundfont = {"id": name, "name": name, "storage_key": f"{name}.sf2"}
+            service._add_selected_instrument(soundfont, role, "")
+
+        assert [i.name for i in service.selected_instruments] == ["Piano", "Violin"]
+        assert service.instruments_by_role["melody"].name == "Piano"
+        assert "chords" not in service.instruments_by_role
+
+
+class TestJsonCommentPattern:
+    @pytest.mark.parametrize(
+        "text, stripped",
+        [
+            ('{"a": 1, // tonic\n"b": 2}', '{"a": 1, \n"b": 2}'),
+            ('{"a": 1} // loops', '{"a": 1} '),
+            ('{"a": /* multi\nline */ 1}', '{"a":  1}'),
+        ],
+    )
+    def test_strips_comments(self, mgs, text, stripped):
+        assert mgs._JSON_COMMENT_RE.sub("", text) == stripped
+
+
+class TestPlaceSegmentNotes:
+    def test_offset_and_clip(self, mgs):
+        bar = 4 * mgs.settings.audio.PPQ
+        notes = [
+            {"pitch": 60, "start": 0, "duration": bar, "velocity": 80},
+            {"pitch": 62, "start": bar, "duration": 2 * bar, "velocity": 80},
+            {"pitch": 64, "start": 2 * bar, "duration": bar, "velocity": 80},
+        ]
+        placed = mgs._place_segment_notes(notes, start_bar=2, bars=2)
+        assert [(n["start"], n["duration"]) for n in placed] == [
+            (2 * bar, bar),
+            (3 * bar, bar),
+        ]
+
+
+class TestHandleCreateMelody:
+    @pytest.fixture
+    def melody_instrument(self, mgs):
+        return mgs.Instrument(
+            id=str(uuid.uuid4()),
+            name="Piano",
+            description="",
+            soundfont_name="Piano",
+            storage_key="soundfonts/piano.sf2",
+            role="melody",
+        )
+
+    @pytest.fixture
+    def composer(self, mgs, monkeypatch):
+        """
+        Stands in for the segment AnthropicClient. Replies are keyed by start bar, and
+        every (system prompt, message) sent is recorded by start bar too.
+        """
+
+        class FakeComposer:
+            replies = {}
+            sent = {}
+
+            def __init__(self, system_prompt="", **kwargs):
+                self.system_prompt = system_prompt
+
+            async def send_message_async(self, message, queue, **kwargs):
+                start_bar = int(re.search(r"writing bars (\d+)-", message)[1]) - 1
+                self.sent[start_bar] = (self.system_prompt, message)
+                reply = self.replies[start_bar]
+                if isinstance(reply, Exception):
+                    raise reply
+                return "", reply
+
+        monkeypatch.setattr(mgs, "AnthropicClient", FakeComposer)
+        return FakeComposer
+
+    @pytest.fixture
+    def ticks_per_bar(self, mgs):
+        return 4 * mgs.settings.audio.PPQ
+
+    @pytest.fixture(autouse=True)
+    def musical_params(self, service):
+        service._set_musical_params("C", "major", "C-G-Am-F", 120, "", "")
+
+    async def test_segments_are_offset_and_merged(
+        self, service, composer, melody_instrument, ticks_per_bar
+    ):
+        # The third whole note of each segment runs past its two bars
+        whole = ("0", "whole")
+        composer.replies = {0: _segment(whole, whole, whole), 2: _segment(whole)}
+        queue = FakeQueue()
+
+        result = await service._handle_create_melody({}, melody_instrument, queue)
+
+        notes = result["notes"]["notes"]
+        assert [n["start"] for n in notes] == [0, ticks_per_bar, 2 * ticks_per_bar]
+        assert all(n["duration"] == ticks_per_bar for n in notes)
+        assert len(queue.actions) == 1
+
+    async def test_segments_share_the_system_prompt(
+        self, service, composer, melody_instrument
+    ):
+        whole = ("0", "whole")
+        composer.replies = {0: _segment(whole), 2: _segment(whole)}
+
+        await service._handle_create_melody({}, melody_instrument, FakeQueue())
+
+        system_prompts = {system_prompt for system_prompt, _ in composer.sent.values()}
+        assert len(system_prompts) == 1
+        assert "write_melody_notes tool" in system_prompts.pop()
+
+    async def test_later_segments_continue_the_opening(
+        self, service, composer, melody_instrument
+    ):
+        composer.replies = {
+            0: _segment(("0", "whole"), ("+4", "whole")),
+            2: _segment(("+3", "whole")),
+        }
+
+        result = await service._handle_create_melody({}, melody_instrument, FakeQueue())
+
+        _, later_message = composer.sent[2]
+        assert '"interval": "+4"' in later_message
+        root = result["notes"]["notes"][0]["pitch"]
+        assert [n["pitch"] - root for n in result["notes"]["notes"]] == [0, 4, 7]
+
+    async def test_failed_segment_is_left_silent(
+        self, service, composer, melody_instrument, ticks_per_bar
+    ):
+        whole = ("0", "whole")
+        composer.replies = {0: _segment(whole, whole), 2: ValueError("no melody")}
+
+        result = await service._handle_create_melody({}, melody_instrument, FakeQueue())
+
+        assert [n["start"] for n in result["notes"]["notes"]] == [0, ticks_per_bar]
+
+    async def test_every_segment_failing(self, service, composer, melody_instrument):
+        composer.replies = {0: ValueError("no melody"), 2: ValueError("no melody")}
+        queue = FakeQueue()
+
+        assert (
+            await service._handle_create_melody({}, melody_instrument, queue) is None
+        )
+        assert queue.actions == []
+
+    @pytest.mark.parametrize(
+        "duration_bars, segment_starts",
+        [
+            ("6", [0, 2, 4]),
+            (3.0, [0, 2]),
+            (2.5, [0, 2]),
+            ("long", [0, 2]),
+            (True, [0, 2]),
+            (100, [0, 2, 4, 6]),
+        ],
+    )
+    async def test_duration_bars(
+        self, service, composer, melody_instrument, duration_bars, segment_starts
+    ):
+        composer.replies = {
+            start_bar: _segment(("0", "whole")) for start_bar in range(0, 100, 2)
+        }
+
+        await service._handle_create_melody(
+            {"duration_bars": duration_bars}, melody_instrument, FakeQueue()
+        )
+
+        assert sorted(composer.sent) == segment_starts
+
+
+class TestReasonAndUseTool:
+    @pytest.fixture
+    def client(self, mgs):
+        """Conversation recording the tools offered per turn; it never calls a tool."""
+
+        class FakeClient:
+            def __init__(self):
+                self.tools_sent = []
+                self.last_tool_uses = {}
+
+            async def send_message_async(self, message, queue, tools, **kwargs):
+                self.tools_sent.append(tools)
+                return "", None
+
+        return FakeClient()
+
+    async def test_offers_only_the_turns_tool(self, mgs, service, client):
+        tool = mgs.SELECT_DRUM_SOUNDS_TOOL
+
+        await service._reason_and_use_tool("message", tool, None, client=client)
+
+        # The reasoning turn and the forced follow-up send the same single tool
+        assert client.tools_sent == [[tool], [tool]]
+
+
+class TestGenerateDrumBeat:
+    @pytest.fixture
+    def composer(self, mgs, monkeypatch):
+        """Stands in for the per-drum AnthropicClient, recording what each is sent."""
+
+        class FakeComposer:
+            sent = []
+
+            def __init__(self, system_prompt="", **kwargs):
+                self.system_prompt = system_prompt
+
+            async def send_message_async(self, message, queue, **kwargs):
+                self.sent.append((self.system_prompt, message))
+                return "", None
+
+        monkeypatch.setattr(mgs, "AnthropicClient", FakeComposer)
+        return FakeComposer
+
+    async def test_patterns_get_the_drum_context(self, service, composer):
+        service.drum_composer.set_system_prompt("Composer prompt")
+        service.drum_composer.append_assistant_message("Punchy kick for trap.")
+        service.musical_params.drum_sounds = [
+            SimpleNamespace(id=uuid.uuid4(), display_name=name)
+            for name in ("Kick", "Snare", "Hat")
+        ]
+
+        await service._generate_drum_beat("Trap uses 808s.", FakeQueue())
+
+        system_prompt, message = next(
+            sent for sent in composer.sent if "for the Hat" in sent[1]
+        )
+        assert system_prompt.startswith("Composer prompt")
+        assert "Trap uses 808s." in system_prompt
+        assert "Punchy kick for trap." in system_prompt
+        assert "The other drum sounds in the beat are: Kick, Snare." in message
+
+
+class TestDecodeDrumSteps:
+    def test_hits_and_rests(self, mgs):
+        assert mgs._decode_drum_steps("x..X-.") == [
+            True,
+            False,
+            False,
+            True,
+            False,
+            False,
+        ]
+
+    def test_separators_are_ignored(self, mgs):
+        assert mgs._decode_drum_steps("x... | x...") == mgs._decode_drum_steps(
+            "x...x..."
+        )
+
+    def test_invalid_characters(self, mgs):
+        assert mgs._decode_drum_steps("x..o") is None
+        assert mgs._decode_drum_steps("x,..") is None
+
+    def test_non_string(self, mgs):
+        assert mgs._decode_drum_steps([True, False]) is None
+        assert mgs._decode_drum_steps(None) is None
+
+
+class TestDrumPatternSchema:
+    @pytest.mark.parametrize(
+        "steps",
+        [
+            "x...x...x...x...x...x...x...x...",
+            "X---X---X---X---X---X---X---X---",
+            "x... x... x... x... | x... x... x... x...",
+            "|x...x...x...x...|x...x...x...x...|",
+            "x...x...x...x...x...x...x...x..",
+            "x...x...x...x...x...x...x...x....",
+            "x..ox...x...x...x...x...x...x...",
+            "",
+        ],
+    )
+    def test_schema_accepts_what_decodes_to_32_steps(self, mgs, steps):
+        schema_pattern = mgs.CREATE_DRUM_PATTERN_TOOL["input_schema"]["properties"][
+            "pattern"
+        ]["pattern"]
+        decoded = mgs._decode_drum_steps(steps)
+
+        assert bool(re.fullmatch(schema_pattern, steps)) == (
+            decoded is not None and len(decoded) == 32
+        )
@@ -1,7 +1,9 @@
 import json
 from dotenv import load_dotenv
 import os
-from anthropic import Anthropic, AsyncAnthropic
+import time
+from anthropic import AsyncAnthropic, DefaultAsyncHttpxClient
+import httpx
 import logging
 
 from app2.sse.sse_queue_manager import SSEQueueManager
@@ -10,6 +12,35 @@ from app2.sse.sse_queue_manager import SSEQueueManager
 load_dotenv()
 logger = logging.getLogger(__name__)
 
+# Read once at import; a composition creates short-lived clients for every melody
+# segment and drum pattern
+DEFAULT_MODEL_ID = os.getenv("MODEL_ID")
+
+# Prompt-caching breakpoint: everything up to and including the marked block is cached
+CACHE_CONTROL = {"type": "ephemeral"}
+
+# Streamed text is forwarded to the SSE queue in batches instead of one event per delta;
+# a batch is sent once it is this old or this long, and at the end of the stream
+STREAM_FLUSH_INTERVAL_SECONDS = 0.05
+STREAM_FLUSH_CHARS = 256
+
+# Every conversation shares one API client (and so one connection pool); an
+# AnthropicClient only holds per-conversation state. A composition issues its melody
+# segments and per-drum patterns concurrently, so the pool keeps plenty of connections
+_shared_async_client: AsyncAnthropic | None = None
+
+
+def get_shared_async_client() -> AsyncAnthropic:
+    global _shared_async_client
+    if _shared_async_client is None:
+        _shared_async_client = AsyncAnthropic(
+            api_key=os.getenv("ANTHROPIC_API_KEY"),
+            http_client=DefaultAsyncHttpxClient(
+                limits=httpx.Limits(max_connections=64, max_keepalive_connections=32)
+            ),
+        )
+    return _shared_async_client
+
 
 class AnthropicClient:
     def __init__(
@@ -18,16 +49,28 @@ class AnthropicClient:
         thinking: bool = False,
         max_tokens: int = 20000,
         temperature: float = 1,
+        async_client: AsyncAnthropic | None = None,
+        cache_system: bool = True,
+        cache_history: bool = True,
     ):
-        # Initialize both sync and async clients
-        self.client = Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
-        self.async_client = AsyncAnthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
-        self.model = os.getenv("MODEL_ID")
+        """
+        cache_system and cache_history set prompt-cache breakpoints on the system
+        prompt and on the tools and latest message. A breakpoint costs a cache write, so
+        it only pays off when a later request resends that prefix: one-shot
+        conversations turn off cache_history, and cache_system only stays on if other
+        requests share the system prompt and are sent after this one.
+        """
+        self.async_client = async_client or get_shared_async_client()
+        self.model = DEFAULT_MODEL_ID
         self.max_tokens = max_tokens
         self.temperature = temperature
         self.messages = []
         self.system_prompt = system_prompt
         self.thinking = thinking
+        self.cache_system = cache_system
+        self.cache_history = cache_history
+        # Inputs of every tool called in the latest response, by tool name
+        self.last_tool_uses: dict[str, dict] = {}
 
     def set_system_prompt(self, system_prompt: str):
         self.system_prompt = system_prompt
@@ -44,41 +87,92 @@ class AnthropicClient:
     def get_messages(self):
         return self.messages
 
+    def clear_messages(self):
+        self.messages = []
+
     def append_user_message(self, message: str):
         self.messages.append({"role": "user", "content": message})
 
     def append_assistant_message(self, message: str):
         self.messages.append({"role": "assistant", "content": message})
 
+    def _get_cached_system(self):
+        """System prompt as a cacheable text block (it is static for the whole conversation)"""
+        if not self.system_prompt:
+            return self.system_prompt
+        return [
+            {"type": "text", "text": self.system_prompt, "cache_control": CACHE_CONTROL}
+        ]
+
+    def _get_cached_messages(self) -> list[dict]:
+        """
+        Conversation with a cache breakpoint on the latest message, so the next turn
+        reads the whole prior conversation from the prompt cache instead of reprocessing it.
+        """
+        *history, latest = self.messages
+        return [
+            *history,
+            {
+                "role": latest["role"],
+                "content": [
+                    {
+                        "type": "text",
+                        "text": latest["content"],
+                        "cache_control": CACHE_CONTROL,
+                    }
+                ],
+            },
+        ]
+
+    @staticmethod
+    def _get_cached_tools(tools: list[dict]) -> list[dict]:
+        """Tool definitions with a cache breakpoint on the last tool (caches the whole tools block)"""
+        return [*tools[:-1], {**tools[-1], "cache_control": CACHE_CONTROL}]
+
     async def send_message_async(
         self,
         message: str,
-        queue: SSEQueueManager,
+        queue: SSEQueueManager | None,
         stream: bool = True,
         tools: list[dict] = [],
         thinking: bool = False,
+        tool_choice: dict | None = None,
+        model: str | None = None,
     ) -> tuple[str, dict]:
         # print("CURRENT MESSAGES", self.messages)
-        """Asynchronous version of send_message - this will not block the event loop"""
+        """
+        Asynchronous version of send_message - this will not block the event loop.
+        Pass queue=None to consume the response without forwarding it to the client.
+        """
         self.append_user_message(message)
+        # Per-call override lets cheap turns of a conversation run on a faster model
+        model = model or self.model
 
         # Log the start of the API call
         logger.info(
-            f"Starting async API call to Anthropic with model {self.model} and message {message}"
+            f"Starting async API call to Anthropic with model {model} and message {message}"
         )
 
         params = {
-            "model": self.model,
+            "model": model,
             "max_tokens": self.max_tokens,
             "temperature": self.temperature,
-            "messages": self.messages,
-            "system": self.system_prompt,
+            "messages": (
+                self._get_cached_messages() if self.cache_history else self.messages
+            ),
+            "system": (
+                self._get_cached_system() if self.cache_system else self.system_prompt
+            ),
             "stream": stream,
         }
 
         if tools:
-            params["tools"] = tools
-            params["tool_choice"] = {"type": "any"}
+            # Pass the same tool list on every turn and pick per turn with tool_choice,
+            # otherwise the tools block (first in the cache prefix) invalidates the cache
+            params["tools"] = (
+                self._get_cached_tools(tools) if self.cache_history else tools
+            )
+            params["tool_choice"] = tool_choice or {"type": "any"}
 
         if thinking:
             params["thinking"] = {"type": "enabled", "budget_tokens": 16000}
@@ -99,93 +193,107 @@ class AnthropicClient:
         return assistant_response, tool_use_json
 
     async def _get_stream_response_async(
-        self, response, queue: SSEQueueManager
+        self, response, queue: SSEQueueManager | None
     ) -> tuple[str, dict]:
         """Asynchronous version of stream response processing"""
-        content_text = ""
-        tool_use_data = []
+        content_parts = []
+        tool_json_parts: list[str] = []
         tool_use_started = False
+        tool_use_name = None
+        # A response may call several tools; each tool_use block is parsed on its own
+        self.last_tool_uses = {}
+        first_tool_use_json = None
+        pending_chunks: list[str] = []
+        pending_chars = 0
+        last_flush = time.monotonic()
+
+        async def forward(text: str, force: bool = False):
+            """Buffers text for the queue and sends the buffer when it is due."""
+            nonlocal pending_chars, last_flush
+            if queue is None:
+                return
+            if text:
+                pending_chunks.append(text)
+                pending_chars += len(text)
+            now = time.monotonic()
+            if pending_chunks and (
+                force
+                or pending_chars >= STREAM_FLUSH_CHARS
+                or now - last_flush >= STREAM_FLUSH_INTERVAL_SECONDS
+            ):
+                await queue.add_chunk("".join(pending_chunks))
+                pending_chunks.clear()
+                pending_chars = 0
+                last_flush = now
 
         # For debugging
         event_types_seen = set()
 
         # Asynchronously iterate through the stream
         async for data in response:
+            # Each attribute is read once per event and reused below
+            event_type = getattr(data, "type", None)
+            delta = getattr(data, "delta", None)
             # For debugging - log the type of event
-            if hasattr(data, "type"):
-                event_types_seen.add(data.type)
-                logger.debug(f"Stream event type: {data.type}")
+            if event_type is not None:
+                event_types_seen.add(event_type)
+                logger.debug("Stream event type: %s", event_type)
             else:
-                logger.debug(f"Unknown data structure: {data}")
-
-            # Handle all possible ways text might be delivered
-            chunk_text = None
-
-            # Check for the new format (content_block_delta with text_delta)
-            if data.type == "content_block_delta" and hasattr(data, "delta"):
-                if (
-                    hasattr(data.delta, "type")
-                    and data.delta.type == "text_delta"
-                    and hasattr(data.delta, "text")
-                ):
-                    chunk_text = data.delta.text
-                # Fallback for direct text property
-                elif hasattr(data.delta, "text"):
-                    chunk_text = data.delta.text
-
-            # Also check the old format for backward compatibility
-            elif hasattr(data, "delta") and hasattr(data.delta, "text"):
-                chunk_text = data.delta.text
-
-            # Process text chunks from any format
-            if chunk_text:
-                content_text += chunk_text
-                logger.debug(f"Received chunk: {chunk_text[:50]}...")
-                await queue.add_chunk(chunk_text)
-
-            # Handle tool use tracking
-            if tool_use_started:
-                tool_use_data.append(data)
-
-            if data.type == "content_block_start":
-                if (
-                    hasattr(data, "content_block")
-                    and hasattr(data.content_block, "type")
-                    and data.content_block.type == "tool_use"
-                ):
+                logger.debug("Unknown data structure: %s", data)
+
+            if delta is not None:
+                # text_delta events (and older formats) carry the text directly
+                chunk_text = getattr(delta, "text", None)
+                if chunk_text:
+                    content_parts.append(chunk_text)
+                    logger.debug("Received chunk: %.50s...", chunk_text)
+                    await forward(chunk_text)
+
+                # Keep only the JSON fragments of the current tool_use block as they arrive
+                if tool_use_started:
+                    partial_json = getattr(delta, "partial_json", None)
+                    if partial_json:
+                        tool_json_parts.append(partial_json)
+
+            if event_type == "content_block_start":
+                content_block = getattr(data, "content_block", None)
+                if getattr(content_block, "type", None) == "tool_use":
                     tool_use_started = True
-                    logger.debug(f"Tool use started: {data.content_block}")
-
-            if data.type == "content_block_stop":
+                    tool_use_name = getattr(content_block, "name", None)
+                    tool_json_parts = []
+                    logger.debug("Tool use started: %s", content_block)
+
+            elif event_type == "content_block_stop":
+                # Each block's text is sent when it ends, not held back while a
+                # following tool_use block streams its input
+                await forward("", force=True)
+                if tool_use_started:
+                    # Parsed as soon as the block closes, while later blocks still stream
+                    tool_input = self._parse_tool_use_json(tool_json_parts)
+                    if tool_input is not None:
+                        self.last_tool_uses.setdefault(tool_use_name, tool_input)
+                        if first_tool_use_json is None:
+                            first_tool_use_json = tool_input
                 tool_use_started = False
                 logger.debug("Content block stopped")
 
-            if data.type == "thinking_delta":
-                if (
-                    hasattr(data.delta, "type")
-                    and data.delta.type == "thinking_delta"
-                    and hasattr(data.delta, "thinking")
-                ):
-                    chunk_text = data.delta.thinking
-                # Fallback for direct text property
-                elif hasattr(data.delta, "text"):
-                    chunk_text = data.delta.text
-                await queue.add_chunk(chunk_text)
-                logger.debug(f"Thinking block delta: {data.delta}")
+            elif event_type == "thinking_delta":
+                chunk_text = getattr(delta, "thinking", None) or getattr(
+                    delta, "text", None
+                )
+                await forward(chunk_text)
+                logger.debug("Thinking block delta: %s", delta)
+        await forward("", force=True)
+
         # Log the event types seen during this stream processing
         logger.info(f"Event types seen in this stream: {event_types_seen}")
 
-        # Parse tool use data
-        tool_use_json = self._parse_tool_use_data(tool_use_data)
-
-        return content_text, tool_use_json
+        # The first tool call's input is returned; all of them are in last_tool_uses
+        return "".join(content_parts), first_tool_use_json
 
-    def _parse_tool_use_data(self, tool_use_data) -> dict:
-        full_json = ""
-        for data in tool_use_data:
-            # Only process RawContentBlockDeltaEvent events that have delta attribute
-            if hasattr(data, "delta") and hasattr(data.delta, "partial_json"):
-                full_json += data.delta.partial_json
+    def _parse_tool_use_json(self, tool_json_parts: list[str]) -> dict:
+        # The fragments are joined once rather than concatenated per delta
+        full_json = "".join(tool_json_parts)
 
         try:
             # Parse the accumulated JSON string into a Python dict